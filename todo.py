@@ -1,17 +1,46 @@
-import json
-import os
+if __name__ == "__main__":
+    # A command for a running daemon only needs the client; leave loading the Manager to todo_daemon
+    from todo_daemon import main
+    raise SystemExit(main())
+
+import atexit
+import sys
+import threading
+from collections import deque, namedtuple
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from functools import wraps
+from operator import attrgetter, itemgetter
+
+from todo_archive import Archive, archive_name
+from todo_query import compile_query
+from todo_search import SearchIndex
+from todo_storage import JOURNAL_COMPACT_BYTES, LazyTasks, open_storage, timed
+
+# Default memory budget for the undo/redo history
+HISTORY_BYTES = 1 << 20
+
+# Pending value for a title whose last written state is not known; it is always written
+_UNSAVED = object()
+
 
 class Task:
-    def __init__(self, title, description=None, category=None, project=None, urgent=False, completed=False):
+    # id is a stable integer handed out by Manager; unlike the title it never changes
+    FIELDS = ('title', 'description', 'category', 'project', 'urgent', 'completed', 'id')
+    __slots__ = FIELDS
+
+    def __init__(self, title, description=None, category=None, project=None, urgent=False, completed=False,
+                 id=None):
         self.title = title
         self.description = description
         self.category = category
         self.project = project
         self.urgent = urgent
         self.completed = completed
+        self.id = id
 
     def to_dict(self):
-        return self.__dict__
+        return {field: getattr(self, field) for field in Task.FIELDS}
 
     def update_title(self, new_title):
         self.title = new_title    
@@ -32,59 +61,434 @@ class Task:
         self.completed = not self.completed
 
 
+def _column(index):
+    def get(self):
+        return self._table._columns[index][self._row]
+
+    def set(self, value):
+        self._table._set(self._row, index, value)
+    return property(get, set)
+
+
+def _flag(bit):
+    def get(self):
+        return bool(self._table._get_flags(self._row) & bit)
+
+    def set(self, value):
+        self._table._set_flag(self._row, bit, value)
+    return property(get, set)
+
+
+class TaskView(Task):
+    """A Task whose fields live in a row of a TaskTable."""
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    title = _column(0)
+    description = _column(1)
+    category = _column(2)
+    project = _column(3)
+    id = _column(4)
+    urgent = _flag(1)
+    completed = _flag(2)
+
+    def detach(self):
+        return Task(**self.to_dict())
+
+
+class TaskTable(MutableMapping):
+    """
+    Columnar title -> Task mapping for large stores.
+    Fields are kept in parallel lists with project/category strings interned,
+    and the urgent/completed flags are packed two bits per task. Lookups
+    return TaskView objects that read and write through to the columns.
+    """
+    URGENT = 1
+    COMPLETED = 2
+
+    def __init__(self, tasks=None):
+        self._rows = {}
+        # title, description, category, project, id
+        self._columns = ([], [], [], [], [])
+        self._flags = bytearray()
+        self._free = []
+        if tasks:
+            self.update(tasks)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __contains__(self, title):
+        return title in self._rows
+
+    def __getitem__(self, title):
+        return TaskView(self, self._rows[title])
+
+    def __setitem__(self, title, task):
+        row = self._rows.get(title)
+        if row is None:
+            row = self._free.pop() if self._free else self._grow()
+            self._rows[title] = row
+
+        values = (title, task.description, task.category, task.project, task.id)
+        for index, value in enumerate(values):
+            self._set(row, index, value)
+        self._set_flag(row, self.URGENT, task.urgent)
+        self._set_flag(row, self.COMPLETED, task.completed)
+
+    def __delitem__(self, title):
+        row = self._rows.pop(title)
+        for column in self._columns:
+            column[row] = None
+        self._free.append(row)
+
+    def pop(self, title, *default):
+        """Returns a detached Task, since the removed row will be reused."""
+        if title not in self._rows:
+            if default:
+                return default[0]
+            raise KeyError(title)
+        task = self[title].detach()
+        del self[title]
+        return task
+
+    def _grow(self):
+        row = len(self._columns[0])
+        for column in self._columns:
+            column.append(None)
+        if row % 4 == 0:
+            self._flags.append(0)
+        return row
+
+    def _set(self, row, index, value):
+        # Projects and categories repeat across many tasks; share one string each
+        if index in (2, 3) and isinstance(value, str):
+            value = sys.intern(value)
+        self._columns[index][row] = value
+
+    def _get_flags(self, row):
+        return (self._flags[row >> 2] >> ((row & 3) * 2)) & 3
+
+    def _set_flag(self, row, bit, value):
+        mask = bit << ((row & 3) * 2)
+        if value:
+            self._flags[row >> 2] |= mask
+        else:
+            self._flags[row >> 2] &= ~mask & 0xFF
+
+
+class Registry:
+    """
+    Insertion-ordered set of project or category names that iterates,
+    compares and saves like the list it replaces, with O(1) membership.
+    Manager also keeps the number of tasks using each name here while its
+    indexes are built; names can be counted without being registered.
+    """
+
+    def __init__(self, names=()):
+        self._names = dict.fromkeys(names)
+        self._uses = {}
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, index):
+        # Positional access is O(n); it is only here for code written against the list
+        return list(self._names)[index]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"Registry({list(self._names)!r})"
+
+    def append(self, name):
+        self._names[name] = None
+
+    def remove(self, name):
+        if name not in self._names:
+            raise ValueError(f"{name!r} is not registered")
+        del self._names[name]
+
+    def replace(self, names):
+        """Swaps in a new list of names, keeping the use counts."""
+        self._names = dict.fromkeys(names)
+
+    def uses(self, name):
+        return self._uses.get(name, 0)
+
+    def _count(self, name, delta):
+        """Adjusts the use count of name and returns the new count."""
+        uses = self._uses[name] = self._uses.get(name, 0) + delta
+        if not uses:
+            del self._uses[name]
+        return uses
+
+
+# kind is 'added', 'updated', 'renamed' or 'deleted' for a task, or
+# 'project_added', 'project_deleted', 'category_added', 'category_deleted'.
+# fields lists what an update changed; old_name is set for renames.
+Event = namedtuple('Event', ['kind', 'name', 'fields', 'old_name'], defaults=((), None))
+
+
+class Snapshot:
+    """
+    A read-only copy of a Manager's tasks, projects and categories as of
+    one finished transaction; see Manager.snapshot(). Its Tasks are copies,
+    so later mutations never show through.
+    """
+
+    def __init__(self, tasks, projects, categories, version):
+        self.tasks = tasks
+        self.projects = projects
+        self.categories = categories
+        self.version = version
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        return iter(self.tasks.values())
+
+    def get(self, title):
+        return self.tasks.get(title)
+
+    def query(self, where='', sort=None, limit=None, after=None):
+        """Like Manager.query(), but scans the snapshot instead of using indexes."""
+        return compile_query(where, sort).run(self.tasks.values(), limit, after)
+
+
+_fields = attrgetter(*Task.FIELDS)
+_record_fields = itemgetter(*Task.FIELDS)
+
+
+def _image(task):
+    """A task's fields as a tuple in Task.FIELDS order, or None for no task."""
+    return None if task is None else _fields(task)
+
+
+def _record_image(record):
+    """The image of a task saved as a dict; a hand-written one may leave fields out."""
+    try:
+        return _record_fields(record)
+    except KeyError:
+        return tuple(record.get(field) for field in Task.FIELDS)
+
+
+def _image_size(image):
+    if image is None:
+        return 0
+    return sys.getsizeof(image) + sum(sys.getsizeof(value) for value in image if isinstance(value, str))
+
+
+def _copy(task):
+    return Task(*_image(task))
+
+
+def _locked(method):
+    """Runs a Manager method while holding the manager's lock."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class Manager:
-    def __init__(self, filename='todo.json'):
+    def __init__(self, filename='todo.json', storage=None, journal=False, compact_bytes=JOURNAL_COMPACT_BYTES,
+                 columnar=False, lazy=False, atomic=False, background=False, max_staleness=1.0,
+                 snapshot=False, metrics=None, history_bytes=HISTORY_BYTES, thread_safe=False,
+                 watch=False, poll_interval=1.0, compact=False):
+        """
+        The storage backend is picked from the file extension ('.db' for
+        SQLite, JSON otherwise) unless one is passed in explicitly.
+        With journal=True a JSON store appends a small record per mutation
+        to '<filename>.journal' instead of rewriting the whole file.
+        With columnar=True tasks are kept in a TaskTable instead of a dict.
+        With lazy=True a JSON store is streamed: tasks are parsed as they are
+        reached and only turned into Task objects when first accessed.
+        With atomic=True a JSON store is saved via fsynced temp file + rename.
+        With background=True mutations are written by a flusher thread that
+        coalesces everything changed within max_staleness seconds into one
+        write; call flush() to write immediately and close() when done.
+        With snapshot=True a JSON store keeps a binary '<filename>.snap' copy
+        that makes startup skip JSON parsing while it is up to date.
+        With compact=True a JSON store is written without indentation; one
+        named '.gz' or '.xz' is compressed (see todo_storage.JsonStorage).
+        metrics, e.g. a todo_metrics.Metrics, receives counters and timings
+        for loads, saves, bytes written and index maintenance.
+        undo() and redo() keep per-task deltas within about history_bytes
+        of memory, dropping the oldest first; 0 turns the history off.
+        subscribe() registers a callback for the Events of each transaction.
+        With thread_safe=True every finished transaction publishes a new
+        Snapshot, so other threads can read via snapshot() without ever
+        waiting for a writer; mutators already serialize on the manager's lock.
+        With watch=True a thread stats the store every poll_interval seconds
+        and reload()s it when another process or tool has changed it.
+        archive_completed() moves finished tasks to `archive`, a compressed
+        '<filename>.archive' that is only read once it is queried.
+        """
         self.filename = filename
+        self.columnar = columnar
+        self.lazy = lazy
+        self.storage = storage or open_storage(filename, journal=journal, compact_bytes=compact_bytes,
+                                                atomic=atomic, snapshot=snapshot, compact=compact)
+        self.metrics = metrics
+        self.storage.metrics = metrics
+        self.search_name = f"{filename}.search"
+        self.archive = Archive(archive_name(filename), Task)
+        self.max_staleness = max_staleness
+        # Guards the in-memory state; _write_lock keeps disk writes in order
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        # One {title: before-image} dict per open batch, innermost last
+        self._batches = []
+        self._batch_meta = []
+        # Titles changed since the last write -> their image as last written
+        self._pending = {}
+        self._pending_meta = False
+        # Projects, categories and next_id as last written
+        self._saved_meta = None
+        # Categories whose last task went away; pruned when the transaction ends
+        self._emptied = {}
+        # (title, category) of tasks changed while there were no use counts; see _prune()
+        self._left = {}
+        # Undo/redo entries: ({title: (before, after)}, (meta before, meta after) or None, size)
+        self.history_bytes = history_bytes
+        self._undo = deque()
+        self._redo = []
+        self._history_size = 0
+        # Before-images of the mutation in progress outside a batch
+        self._op = None
+        self._op_meta = None
+        self._subscribers = []
+        # Published Snapshot and the titles changed since it was taken
+        self.thread_safe = thread_safe
+        self._snapshot = None
+        self._stale = {}
+        self._flusher = None
+        self._watcher = None
+        self.poll_interval = poll_interval
         self._set_defaults()
         self.load_data()
+        if background:
+            self._start_flusher()
+        if watch:
+            self._start_watcher()
 
     def _set_defaults(self):
         """Initializes empty state for the manager."""
-        self.tasks = {}
-        self.projects = ['General']
-        self.categories = []
+        self.tasks = TaskTable() if self.columnar else {}
+        self.projects = Registry(['General'])
+        self.categories = Registry()
+        self._indexed = False
+        self._search_stamp = None
+        self._store_stamp = None
 
+    @_locked
     def load_data(self):
-        if not os.path.exists(self.filename):
+        with timed(self.metrics, 'load'):
+            data = self.storage.load(Task, lazy=self.lazy)
+        if data is None:
+            self._set_defaults()
             self.save_data()
+            self._publish(full=True)
             return
 
-        try:
-            with open(self.filename, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    raise json.JSONDecodeError("Empty file", "", 0)
-                
-                data = json.loads(content)
-                
-                # Reconstruct Task objects
-                self.tasks = {
-                    title: Task(**details) 
-                    for title, details in data.get('tasks', {}).items()
-                }
-                self.projects = data.get('projects', ['General'])
-                self.categories = data.get('categories', [])
-
-        except (json.JSONDecodeError, TypeError, KeyError):
-            # If invalid, rename to backup and start fresh
-            backup_name = f"{self.filename.replace('.json', '')}_backup.json"
-            print(f"Invalid JSON detected. Renaming {self.filename} to {backup_name}")
-            
-            if os.path.exists(self.filename):
-                os.rename(self.filename, backup_name)
-            
-            self._set_defaults()
-            self.save_data()
+        self.tasks, projects, categories = data
+        self.projects, self.categories = Registry(projects), Registry(categories)
+        self._clear_history()
+        if self.storage.next_id is None:
+            self._assign_ids()
+        if self.columnar:
+            self.tasks = TaskTable(self.tasks)
+        # Indexes are built on first use; a saved search index is valid until the first mutation
+        self._indexed = False
+        self._search_stamp = self._store_stamp = self.storage.stamp()
+        self._saved_meta = self._meta_image()
+        self._publish(full=True)
 
+    def _assign_ids(self):
+        """Numbers the tasks of a store saved before task ids existed and rewrites it keyed by id."""
+        tasks = list(self.tasks.values())
+        next_id = max((task.id for task in tasks if task.id is not None), default=-1) + 1
+        for task in tasks:
+            if task.id is None:
+                task.id = next_id
+                next_id += 1
+        self.storage.next_id = next_id
+        self.save_data()
+
+    def _new_id(self):
+        # The counter lives on the storage so it is saved with the projects and categories
+        task_id = self.storage.next_id
+        self.storage.next_id += 1
+        return task_id
+
+    @_locked
     def save_data(self):
-        output = {
-            "tasks": {title: task.to_dict() for title, task in self.tasks.items()},
-            "projects": self.projects,
-            "categories": self.categories
-        }
-        with open(self.filename, 'w') as f:
-            json.dump(output, f, indent=4)
-        
+        """
+        Writes the whole store; files whose content would not change are left
+        alone. Changes another process saved in the meantime are merged in.
+        """
+        with self._write_lock:
+            titles = list(self._pending)
+            self._pending = {}
+            self._pending_meta = False
+            with timed(self.metrics, 'save'):
+                self.storage.save(self.tasks, self.projects, self.categories, titles)
+            self._store_stamp = self.storage.stamp()
+            self._saved_meta = self._meta_image()
+            if self.metrics is not None:
+                self.metrics.incr('saves')
+        merged = self.storage.take_merged()
+        if merged is not None:
+            self._absorb(merged)
+
+    def _meta_image(self):
+        return (list(self.projects), list(self.categories), self.storage.next_id)
+
+    def flush(self):
+        """Writes any pending changes now instead of waiting for the flusher."""
+        self._write_pending()
+
+    def close(self):
+        """
+        Writes pending changes, stops the flusher and releases the storage.
+        The search index is saved so the next load can skip rebuilding it.
+        """
+        if self._watcher:
+            self._unwatch.set()
+            self._watcher.join()
+            self._watcher = None
+        if self._flusher:
+            self._stop.set()
+            self._wake.set()
+            self._flusher.join()
+            self._flusher = None
+            atexit.unregister(self.close)
+        self._write_pending()
+        # The index matches the store as we last read or wrote it, so not if someone has changed it since
+        current = self._store_stamp is not None and self.storage.stamp() == self._store_stamp
+        self.storage.close()
+        self.archive.close()
+        if self._indexed and current:
+            # Closing can checkpoint the store (SQLite's WAL, a journal compaction) without changing its content
+            self._search.save(self.search_name, self.storage.stamp())
+
+    @_locked
     def delete_project(self, project_name, delete_tasks=False):
         """
         Removes a project. 
@@ -99,39 +503,45 @@ class Manager:
             print("Cannot delete the 'General' project.")
             return
 
+        self._ensure_indexes()
+        affected = list(self._by_project.get(project_name, ()))
+        self._touch(*affected)
+
         # Remove the project from the master list
         self.projects.remove(project_name)
-
         if delete_tasks:
-            # Comprehension: Keep only tasks NOT in the deleted project
-            self.tasks = {
-                title: task for title, task in self.tasks.items() 
-                if task.project_name != project_name
-            }
+            for title in affected:
+                del self.tasks[title]
             print(f"Deleted project '{project_name}' and all its tasks.")
         else:
             # Reassign tasks to 'General' instead of deleting them
-            for task in self.tasks.values():
-                if task.project_name == project_name:
-                    task.project_name = 'General'
+            for title in affected:
+                self.tasks[title].update_project('General')
             print(f"Deleted project '{project_name}'. Tasks moved to 'General'.")
 
-        self.save_data()
+        self._changed(*affected, meta=True)
 
+    @_locked
     def add_task(self, title, description=None, category=None, project="General"):
-        new_task = Task(title, description=description, category=category, project=project)
+        self._touch(title)
+        # Replacing a task keeps its id
+        old = self.tasks.get(title)
+        new_task = Task(title, description=description, category=category, project=project,
+                        id=old.id if old is not None else self._new_id())
         self.tasks[title] = new_task
         
         # Ensure project/category exists in our master lists
         if project not in self.projects: self.projects.append(project)
         if category and category not in self.categories: self.categories.append(category)
-        self.save_data()
+        self._changed(title, meta=True)
 
+    @_locked
     def edit_task(self, title, description=None, category=None, project=None):
         if title not in self.tasks:
             print(f"Task '{title}' not found.")
             return
 
+        self._touch(title)
         task = self.tasks[title]
 
         if description is not None:
@@ -147,25 +557,83 @@ class Manager:
             if project not in self.projects:
                 self.projects.append(project)
 
-        self.save_data()
+        self._changed(title, meta=True)
         print(f"Task '{title}' updated successfully.")
 
+    @_locked
     def toggle_task_urgency(self, title):
         if title in self.tasks:
+            self._touch(title)
             self.tasks[title].toggle_urgent()
-            self.save_data()
+            self._changed(title)
             print(f"Urgency updated for '{title}'.")
         else:
             print("Task not found.")
 
+    @_locked
     def toggle_task_status(self, title):
+        """Marks a task done or not done; an archived task is brought back as not done."""
         if title in self.tasks:
+            self._touch(title)
             self.tasks[title].toggle_completed()
-            self.save_data()
+            self._changed(title)
             print(f"Status updated for '{title}'.")
+        elif not self._batches and title in self.archive:
+            self._restore(title)
+            print(f"Status updated for '{title}'; restored from the archive.")
         else:
             print("Task not found.")
 
+    @_locked
+    def archive_completed(self):
+        """
+        Moves every completed task into the archive, so saves and loads no
+        longer pay for it. Like an import this is not undoable and clears
+        the undo history; subscribers see the tasks as deleted.
+        Returns the number of tasks archived.
+        """
+        if self._batches:
+            print("Cannot archive inside a batch.")
+            return 0
+        self._ensure_indexes()
+        titles = list(self._completed)
+        if not titles:
+            return 0
+
+        # Archived before leaving the store: a crash in between leaves a task in both, never in neither
+        with timed(self.metrics, 'archive'):
+            self.archive.add(self.tasks[title] for title in titles)
+        history_bytes, self.history_bytes = self.history_bytes, 0
+        try:
+            self._touch(*titles)
+            for title in titles:
+                del self.tasks[title]
+            self._changed(*titles)
+        finally:
+            self.history_bytes = history_bytes
+            self._clear_history()
+        return len(titles)
+
+    def _restore(self, title):
+        task = self.archive.get(title)
+        history_bytes, self.history_bytes = self.history_bytes, 0
+        try:
+            self._touch(title)
+            self.tasks[title] = Task(*_image(task))
+            self.tasks[title].completed = False
+            if task.project not in self.projects:
+                self.projects.append(task.project)
+            if task.category and task.category not in self.categories:
+                self.categories.append(task.category)
+            self._changed(title, meta=True)
+        finally:
+            self.history_bytes = history_bytes
+            self._clear_history()
+        # On disk in the store before it leaves the archive, even with a background flusher
+        self._write_pending()
+        self.archive.remove([title])
+
+    @_locked
     def rename_task(self, old_title, new_title):
         """Handles the complex dictionary key swap."""
         if old_title not in self.tasks:
@@ -176,6 +644,8 @@ class Manager:
             print(f"Error: A task named '{new_title}' already exists.")
             return
 
+        self._touch(old_title, new_title)
+
         # 1. Pop the task object out of the dict (removes old key)
         task_obj = self.tasks.pop(old_title)
         
@@ -185,22 +655,808 @@ class Manager:
         # 3. Put it back in with the new key
         self.tasks[new_title] = task_obj
         
-        self.save_data()
+        self._changed(old_title, new_title)
         print(f"Renamed '{old_title}' to '{new_title}'.")
 
+    @_locked
     def delete_task(self, title):
         """Removes a task from the dictionary and updates the file."""
         if title in self.tasks:
+            self._touch(title)
             del self.tasks[title]
-            self.save_data()
+            self._changed(title)
             print(f"Task '{title}' deleted.")
         else:
             print(f"Task '{title}' not found.")
 
+    @_locked
+    def import_stream(self, records, checkpoint=None):
+        """
+        Adds or replaces a task for every record, a dict of Task fields, in
+        a single pass. Indexes are kept current and the changes are persisted
+        once at the end, or after every `checkpoint` records.
+        Records without a title are skipped. Returns the number imported.
+        An import is not recorded in the undo history, which it clears.
+        """
+        history_bytes, self.history_bytes = self.history_bytes, 0
+        try:
+            count = self._import(records, checkpoint)
+        finally:
+            # Categories a replaced task left; a batch prunes them when it ends
+            if not self._batches:
+                self._prune()
+            # Before-images were only taken for subscribers
+            if self._op is not None:
+                self._finish(self._op, self._op_meta)
+            self.history_bytes = history_bytes
+            self._clear_history()
+
+        if self.metrics is not None:
+            self.metrics.incr('mutations', count)
+        if count and not self._batches:
+            self._persist()
+        return count
+
+    def _import(self, records, checkpoint):
+        count = 0
+        for record in records:
+            title = record.get('title')
+            if not title:
+                continue
 
+            self._touch(title)
+            # Ids are local to a store; an imported record keeps the id of the task it replaces
+            old = self.tasks.get(title)
+            task = Task(**{field: record[field] for field in Task.FIELDS if field in record})
+            task.id = old.id if old is not None else self._new_id()
+            if not task.project:
+                task.project = 'General'
+            self.tasks[title] = task
+            if task.project not in self.projects:
+                self.projects.append(task.project)
+            if task.category and task.category not in self.categories:
+                self.categories.append(task.category)
+            if self._indexed:
+                self._index(task)
 
+            self._pending_meta = True
+            count += 1
+            if checkpoint and count % checkpoint == 0 and not self._batches:
+                self._write_pending()
+        return count
 
+    def export_stream(self):
+        """Yields every task as a dict; a lazy store is read without caching its tasks."""
+        if self.thread_safe:
+            tasks = self.snapshot().tasks.values()
+        elif self._background_threads():
+            with self._lock:
+                tasks = list(self.tasks.values())
+        else:
+            tasks = self.tasks.scan() if isinstance(self.tasks, LazyTasks) else self.tasks.values()
+        for task in tasks:
+            yield task.to_dict()
 
+    # ------------------------------------------------------------------
+    # Indexes
+    # ------------------------------------------------------------------
+    @_locked
+    def get(self, task_id):
+        """Returns the task with this id, or None. Ids stay the same when a task is renamed."""
+        self._ensure_indexes()
+        if 0 <= task_id < len(self._by_id):
+            title = self._by_id[task_id]
+            if title is not None:
+                return self.tasks[title]
+        return None
 
-if __name__ == "__main__":
-    main()
+    def id_of(self, title):
+        task = self.tasks.get(title)
+        return task.id if task is not None else None
+
+    @_locked
+    def project_count(self, project):
+        """Number of tasks in the project."""
+        self._ensure_indexes()
+        return self.projects.uses(project)
+
+    @_locked
+    def category_count(self, category):
+        """Number of tasks in the category; a category is dropped once this reaches zero."""
+        self._ensure_indexes()
+        return self.categories.uses(category)
+
+    @_locked
+    def tasks_in_project(self, project):
+        self._ensure_indexes()
+        return [self.tasks[title] for title in self._by_project.get(project, ())]
+
+    @_locked
+    def tasks_in_category(self, category):
+        self._ensure_indexes()
+        return [self.tasks[title] for title in self._by_category.get(category, ())]
+
+    @_locked
+    def urgent_tasks(self):
+        self._ensure_indexes()
+        return [self.tasks[title] for title in self._urgent]
+
+    @_locked
+    def completed_tasks(self):
+        self._ensure_indexes()
+        return [self.tasks[title] for title in self._completed]
+
+    @_locked
+    def search(self, query, limit=None):
+        """Full-text search over titles and descriptions, best match first."""
+        self._ensure_indexes()
+        return [self.tasks[title] for title in self._search.search(query, limit)]
+
+    def query(self, where='', sort=None, limit=None, after=None):
+        """
+        Yields tasks matching a filter such as 'urgent !completed project=work',
+        in `sort` order (e.g. 'title' or '-urgent,title'), at most `limit` of them,
+        starting after the task whose cursor is `after`. See todo_query.Query.
+        """
+        query = compile_query(where, sort)
+        if self.thread_safe:
+            # The indexes may change under a concurrent writer; a snapshot cannot
+            return query.run(self.snapshot().tasks.values(), limit, after)
+        if self._background_threads():
+            # The watcher or flusher may take in another writer's changes while the caller iterates
+            with self._lock:
+                return iter(list(query.run(self._candidates(query), limit, after)))
+        return query.run(self._candidates(query), limit, after)
+
+    def pages(self, where='', sort='title', page_size=20, after=None):
+        """Yields lists of up to page_size tasks, each page picking up where the last stopped."""
+        query = compile_query(where, sort)
+        while True:
+            if self.thread_safe:
+                page = list(query.run(self.snapshot().tasks.values(), page_size, after))
+            else:
+                with self._lock:
+                    page = list(query.run(self._candidates(query), page_size, after))
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = query.cursor(page[-1])
+
+    def _background_threads(self):
+        """True while the flusher or watcher thread may change the tasks and indexes."""
+        return self._flusher is not None or self._watcher is not None
+
+    def _candidates(self, query):
+        """The tasks from the smallest index matching one of the query's terms, else all of them."""
+        self._ensure_indexes()
+        indexes = {'project': self._by_project, 'category': self._by_category}
+        flags = {'urgent': self._urgent, 'completed': self._completed}
+        best = None
+        for field, value in query.hints:
+            titles = flags[field] if field in flags else indexes[field].get(value, {})
+            if best is None or len(titles) < len(best):
+                best = titles
+        if best is None:
+            return self.tasks.values()
+        return (self.tasks[title] for title in best)
+
+    @_locked
+    def project_summary(self, project):
+        """Returns {'total', 'open', 'urgent'} counts; 'urgent' only counts open tasks."""
+        self._ensure_indexes()
+        total, open_, urgent = self._project_counts.get(project, (0, 0, 0))
+        return {'total': total, 'open': open_, 'urgent': urgent}
+
+    def _ensure_indexes(self):
+        """Builds every index in one pass over the tasks, reusing a saved search index if valid."""
+        if self._indexed:
+            return
+
+        search = None
+        if self._search_stamp is not None:
+            search = SearchIndex.load(self.search_name, self._search_stamp)
+
+        # Dicts with None values act as insertion-ordered sets of titles
+        self._by_project = {}
+        self._by_category = {}
+        self._urgent = {}
+        self._completed = {}
+        # project -> [total, open, open and urgent]
+        self._project_counts = {}
+        # id -> title, None for ids no longer in use
+        self._by_id = []
+        self.projects._uses.clear()
+        self.categories._uses.clear()
+        self._search = None if search is not None else SearchIndex()
+
+        # A lazy store hands out throwaway Tasks here instead of materializing them all
+        tasks = self.tasks.scan() if isinstance(self.tasks, LazyTasks) else self.tasks.values()
+        with timed(self.metrics, 'index.build'):
+            for task in tasks:
+                self._index(task)
+
+        if search is not None:
+            self._search = search
+        self._indexed = True
+
+        # Older stores never dropped categories; the next write saves the pruned list
+        self._emptied = dict.fromkeys(self.categories)
+        self._prune()
+
+    def _index(self, task):
+        title = task.title
+        by_id = self._by_id
+        if task.id >= len(by_id):
+            by_id.extend([None] * (task.id + 1 - len(by_id)))
+        by_id[task.id] = title
+        self._by_project.setdefault(task.project, {})[title] = None
+        self.projects._count(task.project, 1)
+        if task.category is not None:
+            self._by_category.setdefault(task.category, {})[title] = None
+            self.categories._count(task.category, 1)
+        if task.urgent:
+            self._urgent[title] = None
+        if task.completed:
+            self._completed[title] = None
+        if self._search is not None:
+            self._search.add(task)
+
+        counts = self._project_counts.setdefault(task.project, [0, 0, 0])
+        counts[0] += 1
+        if not task.completed:
+            counts[1] += 1
+            if task.urgent:
+                counts[2] += 1
+
+    def _unindex(self, task):
+        title = task.title
+        self._by_id[task.id] = None
+        self._discard(self._by_project, task.project, title)
+        self.projects._count(task.project, -1)
+        if task.category is not None:
+            self._discard(self._by_category, task.category, title)
+            if not self.categories._count(task.category, -1):
+                self._emptied[task.category] = None
+        self._urgent.pop(title, None)
+        self._completed.pop(title, None)
+        self._search.remove(task)
+
+        counts = self._project_counts[task.project]
+        counts[0] -= 1
+        if not task.completed:
+            counts[1] -= 1
+            if task.urgent:
+                counts[2] -= 1
+        if not counts[0]:
+            del self._project_counts[task.project]
+
+    def _prune(self):
+        """
+        Drops emptied categories that are still unused, marking the metadata
+        for writing; returns True if any were dropped. Use counts are kept
+        with the indexes, so they are built if a task left its category
+        before they were.
+        """
+        if self._left:
+            left, self._left = self._left, {}
+            tasks = self.tasks
+            if not self._indexed and any(title not in tasks or tasks[title].category != category
+                                         for title, category in left):
+                # Building the counts prunes every unused category
+                self._ensure_indexes()
+        if not self._emptied:
+            return False
+        emptied, self._emptied = self._emptied, {}
+        pruned = False
+        for name in emptied:
+            if name in self.categories and not self.categories.uses(name):
+                self.categories.remove(name)
+                pruned = True
+        if pruned:
+            self._pending_meta = True
+        return pruned
+
+    @staticmethod
+    def _discard(index, key, title):
+        titles = index[key]
+        del titles[title]
+        if not titles:
+            del index[key]
+
+    # ------------------------------------------------------------------
+    # Batches
+    # ------------------------------------------------------------------
+    @contextmanager
+    def batch(self):
+        """
+        Groups mutations into one transaction that is persisted once on exit.
+        If the block raises, every task it touched is rolled back to its
+        pre-batch state. Batches nest; an inner failure only undoes the inner block.
+        """
+        with self._lock:
+            if not self._batches:
+                outer_pending = (dict(self._pending), self._pending_meta)
+            self._batches.append({})
+            self._batch_meta.append((list(self.projects), list(self.categories)))
+            try:
+                yield self
+            except BaseException:
+                self._rollback(self._batches.pop(), self._batch_meta.pop())
+                if not self._batches:
+                    self._pending, self._pending_meta = outer_pending
+                    self._emptied = {}
+                    self._left = {}
+                raise
+
+            before = self._batches.pop()
+            meta = self._batch_meta.pop()
+            if self._batches:
+                # Keep the outer batch's older before-images
+                outer = self._batches[-1]
+                for title, image in before.items():
+                    outer.setdefault(title, image)
+                return
+
+            self._prune()
+            self._finish(before, meta)
+            if self._pending or self._pending_meta:
+                self._persist()
+
+    def _touch(self, *titles):
+        """
+        Called before the given tasks change: drops them from the indexes and
+        records their before-images for the batch or the undo history.
+        _changed() re-indexes them.
+        """
+        if self._batches:
+            images = self._batches[-1]
+        elif self.history_bytes or self._subscribers:
+            if self._op is None:
+                self._op = {}
+                self._op_meta = (list(self.projects), list(self.categories))
+            images = self._op
+        else:
+            images = None
+        self._search_stamp = None
+        pending = self._pending
+        with timed(self.metrics, 'index.update'):
+            for title in titles:
+                task = self.tasks.get(title)
+                if task is not None:
+                    if self._indexed:
+                        self._unindex(task)
+                    elif task.category is not None:
+                        self._left[title, task.category] = None
+                if images is not None and title not in images:
+                    images[title] = _image(task)
+                # Not pending yet, so the task is still as last written
+                if title not in pending:
+                    pending[title] = _image(task) if images is None else images[title]
+        if self.thread_safe:
+            self._stale.update(dict.fromkeys(titles))
+
+    def _rollback(self, images, meta):
+        # Everything comes out of the indexes first; a rename leaves two titles with the same id
+        for title in images:
+            task = self.tasks.pop(title, None)
+            if task is not None and self._indexed:
+                self._unindex(task)
+        for title, image in images.items():
+            if image is not None:
+                task = Task(*image)
+                self.tasks[title] = task
+                if self._indexed:
+                    self._index(task)
+        if meta is not None:
+            self.projects.replace(meta[0])
+            self.categories.replace(meta[1])
+
+    def _changed(self, *titles, meta=False):
+        """
+        Persists a mutation of the given tasks.
+        Inside a batch the titles are only collected until the batch ends.
+        """
+        if self._indexed:
+            with timed(self.metrics, 'index.update'):
+                for title in titles:
+                    task = self.tasks.get(title)
+                    if task is not None:
+                        self._index(task)
+        if self.metrics is not None:
+            self.metrics.incr('mutations')
+
+        for title in titles:
+            self._pending.setdefault(title, _UNSAVED)
+        self._pending_meta = self._pending_meta or meta
+        if not self._batches:
+            self._prune()
+            if self._op is not None:
+                op, self._op = self._op, None
+                self._finish(op, self._op_meta)
+            self._persist()
+
+    # ------------------------------------------------------------------
+    # Undo / redo
+    # ------------------------------------------------------------------
+    @_locked
+    def undo(self):
+        """Reverts the last mutation or batch. Returns False if there was nothing to undo."""
+        return self._step(self._undo, self._redo, 0, "undo")
+
+    @_locked
+    def redo(self):
+        """Re-applies the last undone mutation or batch."""
+        return self._step(self._redo, self._undo, 1, "redo")
+
+    def _step(self, source, target, side, name):
+        if self._batches:
+            print(f"Cannot {name} inside a batch.")
+            return False
+        if not source:
+            print(f"Nothing to {name}.")
+            return False
+
+        entry = source.pop()
+        target.append(entry)
+        deltas, meta, size = entry
+        self._search_stamp = None
+        for title in deltas:
+            if title not in self._pending:
+                self._pending[title] = _image(self.tasks.get(title))
+        if self.thread_safe:
+            self._stale.update(dict.fromkeys(deltas))
+        self._rollback({title: pair[side] for title, pair in deltas.items()},
+                       meta[side] if meta else None)
+        # The restored categories are exactly the ones in use at that point
+        self._emptied = {}
+        self._left = {}
+        if self._subscribers:
+            if side == 0:
+                deltas = {title: (after, before) for title, (before, after) in deltas.items()}
+                meta = meta and (meta[1], meta[0])
+            self._notify(deltas, meta)
+
+        # Only the touched tasks are written, so a journaled store appends a few records
+        self._pending_meta = self._pending_meta or meta is not None
+        self._persist()
+        print(f"{name.capitalize()} complete.")
+        return True
+
+    def _finish(self, images, meta):
+        """
+        Turns the before-images of a finished mutation or batch into per-task
+        (before, after) deltas for the undo history and the subscribers.
+        """
+        if not self.history_bytes and not self._subscribers:
+            return
+
+        deltas = {}
+        size = sys.getsizeof(images)
+        for title, before in images.items():
+            after = _image(self.tasks.get(title))
+            if before != after:
+                deltas[title] = (before, after)
+                size += _image_size(before) + _image_size(after)
+
+        after_meta = (list(self.projects), list(self.categories))
+        if after_meta == meta:
+            meta = None
+        else:
+            meta = (meta, after_meta)
+            size += sum(sys.getsizeof(names) for side in meta for names in side)
+        if not deltas and meta is None:
+            return
+
+        if self.history_bytes:
+            self._record(deltas, meta, size)
+        if self._subscribers:
+            self._notify(deltas, meta)
+
+    def _record(self, deltas, meta, size):
+        self._drop_redo()
+        self._undo.append((deltas, meta, size))
+        self._history_size += size
+        while self._history_size > self.history_bytes and self._undo:
+            self._history_size -= self._undo.popleft()[2]
+
+    def _drop_redo(self):
+        for entry in self._redo:
+            self._history_size -= entry[2]
+        self._redo.clear()
+
+    def _clear_history(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._history_size = 0
+        self._op = None
+
+    # ------------------------------------------------------------------
+    # Change notifications
+    # ------------------------------------------------------------------
+    def subscribe(self, callback):
+        """
+        Calls callback(events) with a list of Events once per mutation,
+        outermost batch, import, undo or redo. Returns the callback.
+        """
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def _notify(self, deltas, meta):
+        # A task removed and one added with otherwise identical fields is a rename
+        removed = {}
+        for title, (before, after) in deltas.items():
+            if after is None:
+                removed.setdefault(before[1:], []).append(title)
+        renamed = {}
+        for title, (before, after) in deltas.items():
+            if before is None and removed.get(after[1:]):
+                renamed[title] = removed[after[1:]].pop(0)
+        gone = set(renamed.values())
+
+        events = []
+        for title, (before, after) in deltas.items():
+            if title in renamed:
+                events.append(Event('renamed', title, old_name=renamed[title]))
+            elif title in gone:
+                continue
+            elif before is None:
+                events.append(Event('added', title))
+            elif after is None:
+                events.append(Event('deleted', title))
+            else:
+                fields = tuple(field for field, old, new in zip(Task.FIELDS, before, after) if old != new)
+                events.append(Event('updated', title, fields))
+
+        if meta is not None:
+            for kind, old, new in zip(('project', 'category'), meta[0], meta[1]):
+                old_names, new_names = set(old), set(new)
+                events.extend(Event(f'{kind}_deleted', name) for name in old if name not in new_names)
+                events.extend(Event(f'{kind}_added', name) for name in new if name not in old_names)
+
+        for callback in list(self._subscribers):
+            try:
+                callback(events)
+            except Exception as e:
+                print(f"Subscriber {callback!r} failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Snapshots
+    # ------------------------------------------------------------------
+    def snapshot(self):
+        """
+        Returns a Snapshot of the last finished transaction. With
+        thread_safe=True this is one attribute read that never blocks, so
+        any thread may call it while another one is mutating.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            tasks = {title: _copy(task) for title, task in self.tasks.items()}
+            return Snapshot(tasks, tuple(self.projects), tuple(self.categories), None)
+
+    def _publish(self, full=False):
+        """Publishes a new Snapshot, copying only the tasks changed since the last one."""
+        if not self.thread_safe:
+            return
+        stale, self._stale = self._stale, {}
+        previous = self._snapshot
+        projects, categories = tuple(self.projects), tuple(self.categories)
+        if full or previous is None:
+            tasks = {title: _copy(task) for title, task in self.tasks.items()}
+        elif not stale and (projects, categories) == (previous.projects, previous.categories):
+            return
+        else:
+            # Copy-on-write: unchanged Tasks are shared with the previous snapshot
+            tasks = dict(previous.tasks)
+            for title in stale:
+                task = self.tasks.get(title)
+                if task is None:
+                    tasks.pop(title, None)
+                else:
+                    tasks[title] = _copy(task)
+        version = previous.version + 1 if previous is not None else 0
+        # One assignment, so a reader gets either the old snapshot or the new one
+        self._snapshot = Snapshot(tasks, projects, categories, version)
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def _persist(self):
+        # Every finished transaction ends up here
+        self._publish()
+        if self._flusher:
+            self._wake.set()
+        else:
+            self._write_pending()
+
+    def _write_pending(self):
+        """
+        Snapshots the pending changes under the lock, then writes them with
+        only the write lock held so mutators are not blocked by disk I/O.
+        """
+        with self._lock:
+            pending, meta = self._unsaved(self._pending, self._pending_meta)
+            self._pending = {}
+            self._pending_meta = False
+            if not pending and not meta:
+                return
+            job = self.storage.prepare(self.tasks, self.projects, self.categories, pending, meta)
+            meta_image = self._meta_image() if meta else None
+            # Taken before the state lock is released so writes land in snapshot order
+            self._write_lock.acquire()
+
+        try:
+            with timed(self.metrics, 'save'):
+                job()
+            # What the store looks like as we wrote it, before anyone else gets to it
+            self._store_stamp = self.storage.stamp()
+            if meta:
+                self._saved_meta = meta_image
+            if self.metrics is not None:
+                self.metrics.incr('saves')
+        except OSError:
+            # Keep the changes pending so a later write retries them; the older images win
+            with self._lock:
+                self._pending = {**self._pending, **pending}
+                self._pending_meta = self._pending_meta or meta
+            raise
+        finally:
+            self._write_lock.release()
+
+        # Taken under the state lock so the next prepare() sees whether it is in
+        with self._lock:
+            merged = self.storage.take_merged()
+            if merged is not None:
+                self._absorb(merged)
+
+    @_locked
+    def reload(self):
+        """
+        Takes in changes another process or tool made to the store since we
+        last read or wrote it. Only the tasks that differ are replaced, with
+        their indexes and subscribers updated, instead of re-running
+        load_data(). Returns True if the store had changed.
+        """
+        if not self.storage.refresh():
+            return False
+        self._absorb(self.storage.take_merged())
+        return True
+
+    def _start_watcher(self):
+        self._unwatch = threading.Event()
+        self._watcher = threading.Thread(target=self._watch_loop, daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self):
+        while not self._unwatch.wait(self.poll_interval):
+            try:
+                self.reload()
+            except OSError as e:
+                print(f"Reload failed: {e}")
+
+    def _absorb(self, output):
+        """
+        Takes in the tasks, projects and categories another process wrote,
+        as merged into our last write or read by reload(). Tasks changed here since are kept;
+        the next write merges them in turn. Subscribers are notified.
+        """
+        images = {record['title']: _record_image(record) for record in output['tasks'].values()}
+        tasks = self.tasks
+        pending = self._pending
+        changes = {}
+        for title, task in tasks.items():
+            if title not in pending:
+                before = _fields(task)
+                after = images.get(title)
+                if before != after:
+                    changes[title] = (before, after)
+        for title, after in images.items():
+            if title not in tasks and title not in pending:
+                changes[title] = (None, after)
+        meta = (list(self.projects), list(self.categories))
+
+        # Everything comes out of the indexes first, so ids that moved between titles do not clash
+        renumbered = False
+        for title, (before, after) in changes.items():
+            task = self.tasks.pop(title) if before is not None else None
+            if task is not None and self._indexed:
+                self._unindex(task)
+            renumbered = renumbered or (before is not None and after is not None and before[-1] != after[-1])
+        for title, (before, after) in changes.items():
+            if after is not None:
+                task = self.tasks[title] = Task(*after)
+                if self._indexed:
+                    self._index(task)
+
+        self.storage.next_id = max(self.storage.next_id, output['next_id'])
+        # Tasks not written yet may hold ids the other process has handed out too
+        taken = {after[-1] for before, after in changes.values() if after is not None}
+        for title in self._pending:
+            task = self.tasks.get(title)
+            if task is not None and task.id in taken:
+                if self._indexed:
+                    self._unindex(task)
+                task.id = self._new_id()
+                if self._indexed:
+                    self._index(task)
+                renumbered = True
+        if renumbered:
+            # Undoing would bring back ids that now belong to other tasks
+            self._clear_history()
+
+        if not self._pending_meta:
+            self.projects.replace(output['projects'])
+            self.categories.replace(output['categories'])
+            self._emptied = {}
+            self._left = {}
+        for before, after in changes.values():
+            if after is not None:
+                if after[3] not in self.projects:
+                    self.projects.append(after[3])
+                if after[2] is not None and after[2] not in self.categories:
+                    self.categories.append(after[2])
+        self._saved_meta = (list(output['projects']), list(output['categories']), output['next_id'])
+        self._search_stamp = None
+        # Memory may now hold tasks the store does not; wait for our next write before trusting it again
+        self._store_stamp = None
+
+        after_meta = (list(self.projects), list(self.categories))
+        meta = (meta, after_meta) if after_meta != meta else None
+        if self.metrics is not None:
+            self.metrics.incr('absorbed_tasks', len(changes))
+        if self.thread_safe:
+            self._stale.update(dict.fromkeys(changes))
+            self._publish()
+        if self._subscribers and (changes or meta):
+            self._notify(changes, meta)
+
+    def _unsaved(self, pending, meta):
+        """
+        Drops pending tasks that are back to how they were last written, and
+        the metadata if it is unchanged; a toggle done twice writes nothing.
+        """
+        tasks = self.tasks
+        meta_pending = meta
+        changed = {
+            title: image for title, image in pending.items()
+            if image is _UNSAVED or image != _image(tasks.get(title))
+        }
+        if meta and self._meta_image() == self._saved_meta:
+            meta = False
+
+        if self.metrics is not None:
+            if len(changed) < len(pending):
+                self.metrics.incr('skipped_tasks', len(pending) - len(changed))
+            if (pending or meta_pending) and not changed and not meta:
+                self.metrics.incr('skipped_writes')
+        return changed, meta
+
+    def _start_flusher(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            # Let a burst of mutations pile up, but no longer than max_staleness
+            self._stop.wait(self.max_staleness)
+            self._wake.clear()
+            try:
+                self._write_pending()
+            except OSError as e:
+                print(f"Background save failed: {e}")
+
+
+def main(argv=None):
+    """The 'todo' command line; see todo_daemon for the commands."""
+    from todo_daemon import main as run
+    return run(argv)
@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import zlib
+
+from todo_query import compile_query
+from todo_storage import FileLock
+
+# Archive segments are written rarely and read rarely; favour speed over the last few bytes
+COMPRESS_LEVEL = 6
+# zlib window bits that read gzip framing, checking each member's CRC
+GZIP_WBITS = zlib.MAX_WBITS | 16
+# Every member gzip.compress() writes starts with these bytes
+GZIP_MAGIC = b'\x1f\x8b\x08'
+READ_SIZE = 64 * 1024
+
+
+def archive_name(filename):
+    """The archive of a store sits next to it, as '<store>.archive'."""
+    return filename.rstrip('/' + os.sep) + '.archive'
+
+
+def read_member(f):
+    """
+    Decompresses the gzip member at f's position and leaves f just past it.
+    Returns None, with f anywhere, for a member that is damaged or cut short.
+    """
+    member = zlib.decompressobj(GZIP_WBITS)
+    parts = []
+    while not member.eof:
+        block = f.read(READ_SIZE)
+        if not block:
+            return None
+        try:
+            parts.append(member.decompress(block))
+        except zlib.error:
+            return None
+    f.seek(-len(member.unused_data), os.SEEK_CUR)
+    return b''.join(parts)
+
+
+def find_member(f, position):
+    """Returns the offset of the next gzip header after `position`, or None."""
+    offset = position + 1
+    f.seek(offset)
+    tail = b''
+    while True:
+        block = f.read(READ_SIZE)
+        if not block:
+            return None
+        data = tail + block
+        found = data.find(GZIP_MAGIC)
+        if found >= 0:
+            return offset - len(tail) + found
+        tail = data[1 - len(GZIP_MAGIC):]
+        offset += len(block)
+
+
+class Archive:
+    """
+    Completed tasks moved out of a store so its saves and loads stay small.
+
+    The file is append-only: every change adds one gzip member holding
+    journal-style JSON lines, a 'put' record per archived task and a 'del'
+    record per task taken back out. It is not read until the archive is
+    first used, and after that only the members appended since are read.
+    A damaged member is skipped; one torn by a crash at the end of the
+    file is cut off before the next append, under '<archive>.lock'.
+    """
+
+    def __init__(self, filename, factory):
+        self.filename = filename
+        self._factory = factory
+        self._lock = FileLock(filename)
+        # title -> Task, as of the first _offset bytes of the file; it ends after the last good member
+        self._tasks = {}
+        self._offset = 0
+
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return
+        if size == self._offset:
+            return
+
+        with open(self.filename, 'rb') as f:
+            position = self._offset
+            while position is not None and position < size:
+                f.seek(position)
+                data = read_member(f)
+                if data is None:
+                    # Damaged, or torn by a crash; later members are still read
+                    position = find_member(f, position)
+                    continue
+                self._apply(data)
+                position = self._offset = f.tell()
+
+    def _apply(self, data):
+        for line in data.splitlines():
+            record = json.loads(line)
+            if record["op"] == "put":
+                task = self._factory(**record["task"])
+                self._tasks[task.title] = task
+            else:
+                self._tasks.pop(record["title"], None)
+
+    def _append(self, records):
+        data = gzip.compress(''.join(json.dumps(r) + '\n' for r in records).encode(), COMPRESS_LEVEL)
+        with self._lock.hold():
+            # Other processes' members are read first, so _offset is the end of the last good one
+            self._refresh()
+            with open(self.filename, 'ab') as f:
+                if f.tell() > self._offset:
+                    # Drop a torn member, or the reader would have to skip past it every time
+                    f.truncate(self._offset)
+                f.write(data)
+                f.flush()
+                # Tasks leave the store only once they are safely here
+                os.fsync(f.fileno())
+
+    def add(self, tasks):
+        """Appends the tasks; a title archived before is replaced."""
+        self._append([{"op": "put", "task": task.to_dict()} for task in tasks])
+
+    def remove(self, titles):
+        self._append([{"op": "del", "title": title} for title in titles])
+
+    def get(self, title):
+        self._refresh()
+        return self._tasks.get(title)
+
+    def __contains__(self, title):
+        return self.get(title) is not None
+
+    def __len__(self):
+        self._refresh()
+        return len(self._tasks)
+
+    def __iter__(self):
+        self._refresh()
+        return iter(list(self._tasks.values()))
+
+    def query(self, where='', sort=None, limit=None, after=None):
+        """Like Manager.query(), over the archived tasks."""
+        self._refresh()
+        return compile_query(where, sort).run(list(self._tasks.values()), limit, after)
+
+    def close(self):
+        self._lock.close()
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from todo import Manager, Task, TaskTable
+
+
+def bench_batch(count):
+    """Times `count` add_task calls with a save per call vs. one batch."""
+    with tempfile.TemporaryDirectory() as tmp:
+        per_call = Manager(os.path.join(tmp, 'per_call.json'))
+        start = time.perf_counter()
+        for i in range(count):
+            per_call.add_task(f"task {i}", project=f"project {i % 10}")
+        per_call_time = time.perf_counter() - start
+
+        batched = Manager(os.path.join(tmp, 'batched.json'))
+        start = time.perf_counter()
+        with batched.batch():
+            for i in range(count):
+                batched.add_task(f"task {i}", project=f"project {i % 10}")
+        batch_time = time.perf_counter() - start
+
+    print(f"add_task x{count}")
+    print(f"  save per call: {per_call_time:.3f}s")
+    print(f"  batch():       {batch_time:.3f}s")
+    print(f"  speedup:       {per_call_time / batch_time:.1f}x")
+
+
+def synthetic_task(i):
+    # Build fresh strings each time, the way json.loads hands them over
+    return Task(
+        f"task {i}",
+        description=f"description for task {i}",
+        category=f"category {i % 20}",
+        project=f"project {i % 50}",
+        urgent=i % 7 == 0,
+        completed=i % 3 == 0
+    )
+
+
+def bench_memory(sizes):
+    """Reports traced memory for a dict of slotted Tasks vs. a TaskTable."""
+    layouts = (
+        ('dict of Task', dict),
+        ('TaskTable', TaskTable),
+    )
+    print(f"{'tasks':>10}  {'layout':<14}{'memory':>12}{'per task':>12}")
+    for size in sizes:
+        for label, container in layouts:
+            tracemalloc.start()
+            tasks = container()
+            for i in range(size):
+                task = synthetic_task(i)
+                tasks[task.title] = task
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del tasks
+            print(f"{size:>10}  {label:<14}{current / 1e6:>10.1f}MB{current / size:>11.0f}B")
+
+
+def write_store(filename, size, **options):
+    """Creates a JSON store with `size` synthetic tasks."""
+    manager = Manager(filename, **options)
+    with manager.batch():
+        for i in range(size):
+            task = synthetic_task(i)
+            manager.add_task(task.title, task.description, task.category, task.project)
+    manager.close()
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_startup(sizes, repeat):
+    """Times Manager construction from JSON vs. from a fresh binary snapshot."""
+    print(f"{'tasks':>10}{'json':>10}{'snapshot':>10}{'speedup':>10}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'todo.json')
+            write_store(filename, size)
+            # The first snapshot-mode load writes the snapshot
+            Manager(filename, snapshot=True)
+
+            json_time = best_of(repeat, lambda: Manager(filename))
+            snapshot_time = best_of(repeat, lambda: Manager(filename, snapshot=True))
+        print(f"{size:>10}{json_time:>9.3f}s{snapshot_time:>9.3f}s{json_time / snapshot_time:>9.1f}x")
+
+
+# (label, store name, compact)
+CODECS = (
+    ('json', 'todo.json', False),
+    ('compact', 'todo.json', True),
+    ('gzip', 'todo.json.gz', True),
+    ('xz', 'todo.json.xz', True),
+)
+
+
+def bench_codecs(sizes, repeat):
+    """File size, full save and load time of indented, compact and compressed JSON stores."""
+    print(f"{'tasks':>10}  {'format':<9}{'size':>10}{'save':>10}{'load':>10}")
+    for size in sizes:
+        for label, name, compact in CODECS:
+            with tempfile.TemporaryDirectory() as tmp, open(os.devnull, 'w') as devnull:
+                filename = os.path.join(tmp, name)
+                with contextlib.redirect_stdout(devnull):
+                    write_store(filename, size, compact=compact)
+                    manager = Manager(filename, compact=compact)
+                    # Each save changes a task, as identical content is not rewritten
+                    save_time = best_of(repeat, lambda: manager.toggle_task_urgency('task 1'))
+                    manager.close()
+                    load_time = best_of(repeat, lambda: Manager(filename, compact=compact))
+                file_size = os.path.getsize(filename)
+            print(f"{size:>10}  {label:<9}{file_size / 1e3:>8.0f}kB{save_time:>9.3f}s{load_time:>9.3f}s")
+
+
+# ----------------------------------------------------------------------
+# Operation suite
+# ----------------------------------------------------------------------
+STORE_NAMES = {
+    'json': 'todo.json',
+    'journal': 'todo.json',
+    'sqlite': 'todo.db',
+    'sharded': 'todo.d' + os.sep,
+}
+
+OPERATIONS = ('add_task', 'edit_task', 'toggle_task_status', 'rename_task', 'delete_task',
+              'delete_project', 'save_data', 'load_data')
+
+
+def bytes_written():
+    """Characters this process has passed to write() so far (Linux only, else None)."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def zipf_weights(count, skew):
+    """Weights for `count` names; skew 0 is uniform, higher values favour the first names."""
+    return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+def generate_tasks(size, projects, categories, skew, rng):
+    project_names = ['General'] + [f"project {i}" for i in range(projects - 1)]
+    category_names = [f"category {i}" for i in range(categories)]
+    project_weights = zipf_weights(len(project_names), skew)
+    category_weights = zipf_weights(len(category_names), skew)
+    for i in range(size):
+        yield Task(
+            f"task {i}",
+            description=f"synthetic task {i} {rng.random():.6f}",
+            category=rng.choices(category_names, category_weights)[0] if category_names else None,
+            project=rng.choices(project_names, project_weights)[0],
+        )
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def pick(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': pick(0.50) * 1000,
+        'p90_ms': pick(0.90) * 1000,
+        'p99_ms': pick(0.99) * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def time_each(calls, setup=None):
+    """
+    Runs each zero-argument call, returning latencies and bytes written per
+    call. `setup`, if given, runs untimed before each call.
+    """
+    samples = []
+    start_bytes = bytes_written()
+    for call in calls:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    end_bytes = bytes_written()
+
+    result = percentiles(samples)
+    if start_bytes is not None and samples:
+        result['bytes_written'] = (end_bytes - start_bytes) // len(samples)
+    return result
+
+
+def peak_memory(call):
+    tracemalloc.start()
+    call()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def bench_store(size, args, options):
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, STORE_NAMES[args.storage])
+        manager = Manager(filename, **options)
+        with manager.batch():
+            for task in generate_tasks(size, args.projects, args.categories, args.skew, rng):
+                manager.add_task(task.title, task.description, task.category, task.project)
+
+        ops = min(args.ops, size)
+        titles = rng.sample(sorted(manager.tasks), ops * 3)
+        edit_titles, toggle_titles, rename_titles = titles[:ops], titles[ops:2 * ops], titles[2 * ops:]
+        projects = [p for p in manager.projects if p != 'General'][:ops]
+
+        runs = {
+            'add_task': [lambda i=i: manager.add_task(f"new task {i}", "added", "category 0", "General")
+                         for i in range(ops)],
+            'edit_task': [lambda t=t: manager.edit_task(t, description="edited") for t in edit_titles],
+            'toggle_task_status': [lambda t=t: manager.toggle_task_status(t) for t in toggle_titles],
+            'rename_task': [lambda t=t: manager.rename_task(t, t + " renamed") for t in rename_titles],
+            'delete_task': [lambda t=t: manager.delete_task(t + " renamed") for t in rename_titles],
+            'delete_project': [lambda p=p, i=i: manager.delete_project(p, delete_tasks=i % 2 == 0)
+                               for i, p in enumerate(projects)],
+            'save_data': [manager.save_data] * args.repeat,
+            'load_data': [manager.load_data] * args.repeat,
+        }
+        # A save with nothing changed skips the write, so change a task behind the
+        # Manager's back first; save_data then writes it like any other change
+        def change_task():
+            task = manager.tasks[edit_titles[0]]
+            task.description = f"saved {time.perf_counter()}"
+        setups = {'save_data': change_task}
+
+        for name in OPERATIONS:
+            if runs[name]:
+                results[name] = time_each(runs[name], setups.get(name))
+
+        change_task()
+        results['save_data']['peak_mb'] = peak_memory(manager.save_data)
+        results['load_data']['peak_mb'] = peak_memory(manager.load_data)
+        manager.close()
+    return results
+
+
+def print_results(size, results):
+    print(f"\n{size} tasks")
+    print(f"  {'operation':<20}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'bytes':>12}{'peak':>10}")
+    for name, r in results.items():
+        written = r.get('bytes_written')
+        peak = r.get('peak_mb')
+        print(f"  {name:<20}{r['p50_ms']:>8.2f}ms{r['p90_ms']:>8.2f}ms{r['p99_ms']:>8.2f}ms"
+              f"{r['max_ms']:>8.2f}ms{written if written is not None else '-':>12}"
+              f"{f'{peak:.1f}MB' if peak is not None else '-':>10}")
+
+
+def compare(results, baseline, threshold):
+    """Returns (size, operation, metric, old, new) for every metric that grew past `threshold` times."""
+    regressions = []
+    for size, operations in results['results'].items():
+        for name, metrics in operations.items():
+            old_metrics = baseline.get('results', {}).get(size, {}).get(name)
+            if not old_metrics:
+                continue
+            for metric in ('p50_ms', 'p90_ms', 'bytes_written', 'peak_mb'):
+                old, new = old_metrics.get(metric), metrics.get(metric)
+                if old and new is not None and new > old * threshold:
+                    regressions.append((size, name, metric, old, new))
+    return regressions
+
+
+def bench_suite(args):
+    options = {
+        'journal': args.storage == 'journal',
+        'columnar': args.columnar,
+        'lazy': args.lazy,
+        'atomic': args.atomic,
+        'snapshot': args.snapshot,
+    }
+    results = {
+        'meta': {
+            'storage': args.storage,
+            'options': options,
+            'projects': args.projects,
+            'categories': args.categories,
+            'skew': args.skew,
+            'ops': args.ops,
+            'seed': args.seed,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+
+    with open(os.devnull, 'w') as devnull:
+        for size in args.sizes:
+            # Manager reports every change on stdout; keep the table readable
+            with contextlib.redirect_stdout(devnull):
+                store_results = bench_store(size, args, options)
+            results['results'][str(size)] = store_results
+            print_results(size, store_results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if not regressions:
+            print(f"\nNo regressions against {args.baseline} (threshold {args.threshold}x)")
+            return 0
+        print(f"\nRegressions against {args.baseline} (threshold {args.threshold}x):")
+        for size, name, metric, old, new in regressions:
+            print(f"  {size:>8} {name:<20}{metric:<15}{old:>12.2f} -> {new:.2f}")
+        return 1
+    return 0
+
+
+# ----------------------------------------------------------------------
+# Thread stress test
+# ----------------------------------------------------------------------
+def check_snapshot(snapshot, size):
+    """Returns what is wrong with a snapshot, or None; every writer transaction keeps these true."""
+    if len(snapshot) != size:
+        return f"{len(snapshot)} tasks instead of {size}"
+    urgent = 0
+    for title, task in snapshot.tasks.items():
+        if task.title != title:
+            return f"task '{task.title}' stored under '{title}'"
+        urgent += task.urgent
+    if urgent != size // 2:
+        return f"{urgent} urgent tasks instead of {size // 2}"
+    return None
+
+
+def stress_writer(manager, number, rng, stop, counts):
+    """Transactions that keep the task count and the number of urgent tasks unchanged."""
+    done = 0
+    while not stop.is_set():
+        with manager.batch():
+            kind = rng.randrange(3)
+            if kind == 0:
+                # Swap urgency between an urgent and a non-urgent task
+                urgent = manager.urgent_tasks()
+                calm = [task for task in manager.tasks.values() if not task.urgent]
+                manager.toggle_task_urgency(rng.choice(urgent).title)
+                manager.toggle_task_urgency(rng.choice(calm).title)
+            elif kind == 1:
+                manager.rename_task(rng.choice(list(manager.tasks)), f"writer {number} task {done}")
+            else:
+                calm = [task for task in manager.tasks.values() if not task.urgent]
+                manager.delete_task(rng.choice(calm).title)
+                manager.add_task(f"writer {number} task {done}", project=f"project {done % 10}")
+        done += 1
+    counts[f"writer {number}"] = done
+
+
+def stress_reader(manager, number, size, stop, counts, failures):
+    reads = 0
+    version = -1
+    while not stop.is_set():
+        snapshot = manager.snapshot()
+        if snapshot.version < version:
+            failures.append(f"reader {number}: version went back from {version} to {snapshot.version}")
+        version = snapshot.version
+        problem = check_snapshot(snapshot, size)
+        if problem:
+            failures.append(f"reader {number}, version {version}: {problem}")
+        sum(1 for _ in snapshot.query('urgent project="project 0"'))
+        reads += 1
+    counts[f"reader {number}"] = reads
+
+
+def bench_threads(args):
+    """Runs reader and writer threads against one thread-safe Manager and checks every snapshot."""
+    size = args.tasks - args.tasks % 2
+    failures = []
+    counts = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, STORE_NAMES[args.storage])
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            manager = Manager(filename, journal=args.storage == 'journal', background=args.background,
+                              thread_safe=True)
+            with manager.batch():
+                for i in range(size):
+                    task = synthetic_task(i)
+                    manager.add_task(task.title, task.description, task.category, task.project)
+                    if i % 2:
+                        manager.toggle_task_urgency(task.title)
+
+            stop = threading.Event()
+            threads = [threading.Thread(target=stress_writer,
+                                        args=(manager, i, random.Random(args.seed + i), stop, counts))
+                       for i in range(args.writers)]
+            threads += [threading.Thread(target=stress_reader, args=(manager, i, size, stop, counts, failures))
+                        for i in range(args.readers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            final = manager.snapshot()
+            problem = check_snapshot(final, size)
+            if problem:
+                failures.append(f"final snapshot: {problem}")
+            live = {title: (task.urgent, task.project) for title, task in manager.tasks.items()}
+            if live != {title: (task.urgent, task.project) for title, task in final.tasks.items()}:
+                failures.append("final snapshot differs from the manager's tasks")
+            manager.close()
+            reloaded = Manager(filename, journal=args.storage == 'journal')
+            if live != {title: (task.urgent, task.project) for title, task in reloaded.tasks.items()}:
+                failures.append("the reloaded store differs from the manager's tasks")
+            reloaded.close()
+
+    writes = sum(count for name, count in counts.items() if name.startswith('writer'))
+    reads = sum(count for name, count in counts.items() if name.startswith('reader'))
+    print(f"{args.writers} writers, {args.readers} readers, {size} tasks, {args.seconds}s")
+    print(f"  transactions: {writes:>10} ({writes / args.seconds:,.0f}/s)")
+    print(f"  snapshot reads: {reads:>8} ({reads / args.seconds:,.0f}/s)")
+    print(f"  snapshot versions: {final.version:>5}")
+    if failures:
+        print(f"{len(failures)} consistency failures, e.g.:")
+        for failure in failures[:10]:
+            print(f"  {failure}")
+        return 1
+    print("  every snapshot was consistent")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for todo.Manager")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = subparsers.add_parser('batch', help='Per-call saves vs. Manager.batch()')
+    batch_parser.add_argument('-n', '--count', type=int, default=1000,
+                              help='Number of tasks to add (default: 1000)')
+
+    memory_parser = subparsers.add_parser('memory', help='Memory of dict vs. columnar task storage')
+    memory_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000],
+                               help='Store sizes to measure (default: 10000 100000 1000000)')
+
+    startup_parser = subparsers.add_parser('startup', help='Manager load time from JSON vs. snapshot')
+    startup_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[1_000, 10_000, 100_000],
+                                help='Store sizes to measure (default: 1000 10000 100000)')
+    startup_parser.add_argument('-r', '--repeat', type=int, default=3,
+                                help='Loads per measurement; the best is reported (default: 3)')
+
+    codecs_parser = subparsers.add_parser('codecs', help='Size, save and load time of plain, compact and compressed JSON')
+    codecs_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[1_000, 10_000, 100_000],
+                               help='Store sizes to measure (default: 1000 10000 100000)')
+    codecs_parser.add_argument('-r', '--repeat', type=int, default=3,
+                               help='Saves and loads per measurement; the best is reported (default: 3)')
+
+    suite_parser = subparsers.add_parser('suite', help='Latency, bytes written and memory of every Manager operation')
+    suite_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[10_000],
+                              help='Store sizes to measure, e.g. 10000 100000 1000000 (default: 10000)')
+    suite_parser.add_argument('--ops', type=int, default=20,
+                              help='Calls timed per mutating operation (default: 20)')
+    suite_parser.add_argument('-r', '--repeat', type=int, default=3,
+                              help='Calls timed for load_data/save_data (default: 3)')
+    suite_parser.add_argument('--projects', type=int, default=50,
+                              help='Number of projects, including General (default: 50)')
+    suite_parser.add_argument('--categories', type=int, default=20,
+                              help='Number of categories (default: 20)')
+    suite_parser.add_argument('--skew', type=float, default=1.0,
+                              help='Zipf exponent for project/category sizes; 0 is uniform (default: 1.0)')
+    suite_parser.add_argument('--seed', type=int, default=0,
+                              help='Random seed for the synthetic store (default: 0)')
+    suite_parser.add_argument('--storage', choices=sorted(STORE_NAMES), default='json',
+                              help='Storage backend to measure (default: json)')
+    suite_parser.add_argument('--columnar', action='store_true', help='Use Manager(columnar=True)')
+    suite_parser.add_argument('--lazy', action='store_true', help='Use Manager(lazy=True)')
+    suite_parser.add_argument('--atomic', action='store_true', help='Use Manager(atomic=True)')
+    suite_parser.add_argument('--snapshot', action='store_true', help='Use Manager(snapshot=True)')
+    suite_parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    suite_parser.add_argument('-b', '--baseline', help='Compare against results saved earlier with --output')
+    suite_parser.add_argument('-t', '--threshold', type=float, default=1.25,
+                              help='Flag metrics that grew more than this factor (default: 1.25)')
+
+    threads_parser = subparsers.add_parser('threads', help='Concurrent readers and writers on one thread-safe Manager')
+    threads_parser.add_argument('--readers', type=int, default=4, help='Reader threads (default: 4)')
+    threads_parser.add_argument('--writers', type=int, default=4, help='Writer threads (default: 4)')
+    threads_parser.add_argument('-n', '--tasks', type=int, default=1000,
+                                help='Tasks in the store, kept constant by the writers (default: 1000)')
+    threads_parser.add_argument('--seconds', type=float, default=3.0, help='How long to run (default: 3)')
+    threads_parser.add_argument('--storage', choices=sorted(STORE_NAMES), default='json',
+                                help='Storage backend to write to (default: json)')
+    threads_parser.add_argument('--background', action='store_true', help='Use Manager(background=True)')
+    threads_parser.add_argument('--seed', type=int, default=0, help='Random seed for the writers (default: 0)')
+
+    args = parser.parse_args()
+
+    if args.command == 'suite':
+        return bench_suite(args)
+    if args.command == 'threads':
+        return bench_threads(args)
+    if args.command == 'batch':
+        bench_batch(args.count)
+    elif args.command == 'memory':
+        bench_memory(args.sizes)
+    elif args.command == 'startup':
+        bench_startup(args.sizes, args.repeat)
+    elif args.command == 'codecs':
+        bench_codecs(args.sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,309 @@
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+from contextlib import redirect_stdout
+
+# The client only needs the socket; Manager and the server are imported where they are used,
+# so a command sent to a running daemon does not pay for loading them
+
+# How long the client waits for the daemon before running the command itself
+CONNECT_TIMEOUT = 0.5
+
+
+def socket_path(store):
+    """The daemon for a store listens next to it, on '<store>.sock'."""
+    return os.path.abspath(store.rstrip('/' + os.sep)) + '.sock'
+
+
+def format_task(task):
+    done = 'x' if task.completed else ' '
+    urgent = '!' if task.urgent else ' '
+    where = task.project + (f"/{task.category}" if task.category else '')
+    line = f"[{done}]{urgent} {task.title} ({where})"
+    return line + (f" - {task.description}" if task.description else '')
+
+
+# ----------------------------------------------------------------------
+# Commands: each takes the manager and the parsed arguments as a dict
+# ----------------------------------------------------------------------
+def cmd_add(manager, args):
+    manager.add_task(args['title'], args['description'], args['category'], args['project'] or 'General')
+    print(f"Added '{args['title']}'.")
+
+
+def cmd_edit(manager, args):
+    manager.edit_task(args['title'], args['description'], args['category'], args['project'])
+
+
+def cmd_urgent(manager, args):
+    manager.toggle_task_urgency(args['title'])
+
+
+def cmd_done(manager, args):
+    manager.toggle_task_status(args['title'])
+
+
+def cmd_rename(manager, args):
+    manager.rename_task(args['old'], args['new'])
+
+
+def cmd_delete(manager, args):
+    manager.delete_task(args['title'])
+
+
+def cmd_delete_project(manager, args):
+    manager.delete_project(args['name'], delete_tasks=args['delete_tasks'])
+
+
+def cmd_list(manager, args):
+    source = manager.archive if args['archived'] else manager
+    for task in source.query(args['where'], args['sort'], args['limit']):
+        print(format_task(task))
+
+
+def cmd_search(manager, args):
+    for task in manager.search(args['query'], args['limit']):
+        print(format_task(task))
+
+
+def cmd_archive(manager, args):
+    print(f"Archived {manager.archive_completed()} completed tasks.")
+
+
+def cmd_undo(manager, args):
+    manager.undo()
+
+
+def cmd_redo(manager, args):
+    manager.redo()
+
+
+COMMANDS = {
+    'add': cmd_add,
+    'edit': cmd_edit,
+    'urgent': cmd_urgent,
+    'done': cmd_done,
+    'rename': cmd_rename,
+    'delete': cmd_delete,
+    'delete-project': cmd_delete_project,
+    'list': cmd_list,
+    'search': cmd_search,
+    'archive': cmd_archive,
+    'undo': cmd_undo,
+    'redo': cmd_redo,
+}
+
+
+def execute(manager, args):
+    """Runs one command; returns its exit status. Output goes to stdout."""
+    try:
+        COMMANDS[args['command']](manager, args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+# ----------------------------------------------------------------------
+# Daemon
+# ----------------------------------------------------------------------
+def handle_request(handler):
+    """One JSON request line in, one JSON response line out."""
+    try:
+        args = json.loads(handler.rfile.readline())
+    except json.JSONDecodeError:
+        return
+
+    output = io.StringIO()
+    if args.get('command') == 'stop':
+        handler.server.stopping = True
+        status = 0
+        print("Daemon stopped.", file=output)
+    else:
+        # Requests are served one at a time, so swapping stdout is safe
+        with redirect_stdout(output):
+            try:
+                status = execute(handler.server.manager, args)
+            except Exception as e:
+                print(f"Error: {e}")
+                status = 1
+    handler.wfile.write(json.dumps({"status": status, "output": output.getvalue()}).encode() + b'\n')
+
+
+def make_server(path, manager):
+    """A Unix socket server that runs the requests it accepts on `manager`."""
+    import socketserver
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        handle = handle_request
+
+    class TodoServer(socketserver.UnixStreamServer):
+        def __init__(self):
+            self.manager = manager
+            self.stopping = False
+            super().__init__(path, RequestHandler)
+
+    return TodoServer()
+
+
+def daemon_running(path):
+    if not os.path.exists(path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def _exit(signum, frame):
+    raise SystemExit(0)
+
+
+def serve(store, **options):
+    """Keeps a Manager for `store` warm and serves commands until stopped."""
+    path = socket_path(store)
+    if daemon_running(path):
+        print(f"A daemon is already serving {store} on {path}.")
+        return 1
+    if os.path.exists(path):
+        # Left behind by a daemon that did not shut down cleanly
+        os.remove(path)
+
+    from todo import Manager
+
+    # Replies go out before the store is rewritten; stopping flushes what is left
+    manager = Manager(store, background=True, **options)
+    server = make_server(path, manager)
+    # Turn SIGTERM into a normal exit so pending writes are flushed below
+    signal.signal(signal.SIGTERM, _exit)
+    print(f"Serving {store} on {path}.")
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        manager.close()
+    return 0
+
+
+def send(store, args):
+    """
+    Sends a command to the store's daemon and prints its output.
+    Returns the exit status, or None if no daemon is listening.
+    """
+    path = socket_path(store)
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        try:
+            # Connected; the command itself may take as long as it needs
+            sock.settimeout(None)
+            sock.sendall(json.dumps(args).encode() + b'\n')
+            response = json.loads(sock.makefile('rb').readline())
+        except (OSError, json.JSONDecodeError) as e:
+            # The daemon may already have run it; running it again here could undo it, e.g. a toggle
+            print(f"Error: no reply from the daemon ({e}); the command may or may not have run.")
+            return 1
+
+    print(response['output'], end='')
+    return response['status']
+
+
+# ----------------------------------------------------------------------
+# Command line
+# ----------------------------------------------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='todo',
+        description="Manage todo tasks. Commands go to a running 'todo daemon' when there is one."
+    )
+    parser.add_argument('--store', default='todo.json', help='Todo store to use (default: todo.json)')
+    parser.add_argument('--local', action='store_true', help='Run in this process even if a daemon is running')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('add', 'edit'):
+        sub = subparsers.add_parser(name, help=f'{name.capitalize()} a task')
+        sub.add_argument('title')
+        sub.add_argument('-d', '--description')
+        sub.add_argument('-c', '--category')
+        sub.add_argument('-p', '--project')
+
+    for name, help_text in (('urgent', 'Toggle whether a task is urgent'),
+                            ('done', 'Toggle whether a task is completed'),
+                            ('delete', 'Delete a task')):
+        subparsers.add_parser(name, help=help_text).add_argument('title')
+
+    rename = subparsers.add_parser('rename', help='Rename a task')
+    rename.add_argument('old')
+    rename.add_argument('new')
+
+    delete_project = subparsers.add_parser('delete-project', help="Delete a project, moving its tasks to 'General'")
+    delete_project.add_argument('name')
+    delete_project.add_argument('--delete-tasks', action='store_true', help='Delete its tasks instead')
+
+    listing = subparsers.add_parser('list', help="List tasks, e.g. list 'urgent !completed' --sort title")
+    listing.add_argument('where', nargs='?', default='', help='Filter, see todo_query.Query')
+    # A descending sort starts with '-', which argparse only takes as a value after '='
+    listing.add_argument('--sort', help="Sort fields, e.g. --sort project,title or --sort=-urgent")
+    listing.add_argument('--limit', type=int)
+    listing.add_argument('--archived', action='store_true', help='List archived tasks instead')
+
+    search = subparsers.add_parser('search', help='Full-text search over titles and descriptions')
+    search.add_argument('query')
+    search.add_argument('--limit', type=int)
+
+    subparsers.add_parser('archive', help='Move completed tasks to the archive; "done" brings one back')
+    subparsers.add_parser('undo', help='Undo the last change')
+    subparsers.add_parser('redo', help='Redo the last undone change')
+
+    daemon = subparsers.add_parser('daemon', help='Serve commands for the store from a warm Manager')
+    daemon.add_argument('--journal', action='store_true', help='Append changes to a journal instead of rewriting')
+    daemon.add_argument('--snapshot', action='store_true', help='Keep a binary snapshot for faster restarts')
+    subparsers.add_parser('stop', help='Stop the running daemon')
+    return parser
+
+
+def main(argv=None):
+    args = vars(build_parser().parse_args(argv))
+    store = args.pop('store')
+    local = args.pop('local')
+
+    if args['command'] == 'daemon':
+        # Pick up edits made to the store behind the daemon's back
+        return serve(store, journal=args['journal'], snapshot=args['snapshot'], watch=True)
+
+    if not local:
+        status = send(store, args)
+        if status is not None:
+            return status
+    if args['command'] == 'stop':
+        print("No daemon is running.")
+        return 1
+
+    from todo import Manager
+
+    manager = Manager(store)
+    try:
+        return execute(manager, args)
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
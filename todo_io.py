@@ -0,0 +1,133 @@
+import argparse
+import csv
+import json
+import sys
+import time
+
+from todo import Manager
+from todo_storage import TASK_FIELDS
+
+FORMATS = ('jsonl', 'csv')
+TRUE_STRINGS = {'1', 'true', 'yes', 'y'}
+
+
+def guess_format(filename):
+    """Picks the format from the file extension; JSONL unless it ends in '.csv'."""
+    return 'csv' if filename.lower().endswith('.csv') else 'jsonl'
+
+
+def read_jsonl(f):
+    """Yields one task dict per non-blank line."""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(f):
+    """Yields one task dict per row; the header names the Task fields."""
+    for row in csv.DictReader(f):
+        record = {field: row[field] or None for field in TASK_FIELDS if field in row}
+        for flag in ('urgent', 'completed'):
+            if flag in record:
+                record[flag] = (record[flag] or '').strip().lower() in TRUE_STRINGS
+        yield record
+
+
+def write_jsonl(records, f):
+    count = 0
+    for record in records:
+        f.write(json.dumps(record))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def write_csv(records, f):
+    writer = csv.DictWriter(f, fieldnames=TASK_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv}
+
+
+def open_text(filename, mode):
+    """Opens a file for the csv/json readers, with '-' meaning stdin/stdout."""
+    if filename == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    return open(filename, mode, newline='')
+
+
+def import_file(manager, filename, fmt=None, checkpoint=None):
+    fmt = fmt or guess_format(filename)
+    f = open_text(filename, 'r')
+    try:
+        return manager.import_stream(READERS[fmt](f), checkpoint=checkpoint)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def export_file(manager, filename, fmt=None):
+    fmt = fmt or guess_format(filename)
+    f = open_text(filename, 'w')
+    try:
+        return WRITERS[fmt](manager.export_stream(), f)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of todo tasks as JSONL or CSV")
+    parser.add_argument('--store', default='todo.json', help='Todo store to use (default: todo.json)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importer = subparsers.add_parser('import', help='Add or replace tasks from a file')
+    importer.add_argument('source', help="File to read, or '-' for stdin")
+    importer.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+    importer.add_argument('--checkpoint', type=int, default=None,
+                          help='Persist after every N records, keeping them if a later one fails '
+                               '(default: once at the end, importing nothing on failure)')
+
+    exporter = subparsers.add_parser('export', help='Write every task to a file')
+    exporter.add_argument('target', help="File to write, or '-' for stdout")
+    exporter.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+
+    args = parser.parse_args(argv)
+
+    # One command per process, so there is nothing to undo later
+    manager = Manager(args.store, lazy=args.command == 'export', history_bytes=0)
+    start = time.perf_counter()
+    try:
+        if args.command == 'import' and args.checkpoint is None:
+            # A failure rolls back the records imported before it
+            with manager.batch():
+                count = import_file(manager, args.source, args.format)
+            verb = 'Imported'
+        elif args.command == 'import':
+            count = import_file(manager, args.source, args.format, args.checkpoint)
+            verb = 'Imported'
+        else:
+            count = export_file(manager, args.target, args.format)
+            verb = 'Exported'
+    except (OSError, ValueError, KeyError) as e:
+        print(f"{args.command.capitalize()} failed: {e}")
+        if args.command == 'import' and args.checkpoint is not None:
+            print("The records imported before the failure were saved.")
+        return 1
+    finally:
+        manager.close()
+
+    if args.command == 'import' or args.target != '-':
+        print(f"{verb} {count} tasks in {time.perf_counter() - start:.2f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,63 @@
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Collects counters and timings reported by Manager and its storage.
+
+    Anything with the same incr()/timing() methods can be passed to
+    Manager(metrics=...) instead; `callback`, if given, is also called as
+    callback(kind, name, value) for every report, e.g. to forward to statsd.
+    With no metrics object the instrumented paths skip all of this.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counters = {}
+        # name -> [calls, total seconds, max seconds]
+        self.timings = {}
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.callback:
+            self.callback('counter', name, value)
+
+    def timing(self, name, seconds):
+        entry = self.timings.get(name)
+        if entry is None:
+            self.timings[name] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+        if self.callback:
+            self.callback('timing', name, seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(name, time.perf_counter() - start)
+
+    def saves_per_mutation(self):
+        mutations = self.counters.get('mutations', 0)
+        return self.counters.get('saves', 0) / mutations if mutations else 0.0
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+    def report(self):
+        lines = []
+        for name in sorted(self.counters):
+            lines.append(f"{name:<28}{self.counters[name]:>14}")
+        if self.counters.get('mutations'):
+            lines.append(f"{'saves per mutation':<28}{self.saves_per_mutation():>14.3f}")
+        for name in sorted(self.timings):
+            calls, total, longest = self.timings[name]
+            lines.append(f"{name:<28}{calls:>6} calls {total * 1000:>10.2f}ms total {longest * 1000:>9.2f}ms max")
+        return '\n'.join(lines)
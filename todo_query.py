@@ -0,0 +1,160 @@
+import heapq
+import shlex
+from functools import lru_cache
+from itertools import islice
+
+from todo_storage import TASK_FIELDS
+
+FLAGS = ('urgent', 'completed')
+# Fields Manager keeps an index for; an '=' term on one narrows the candidates
+INDEXED = ('project', 'category') + FLAGS
+TRUE_STRINGS = {'1', 'true', 'yes', 'y'}
+FALSE_STRINGS = {'0', 'false', 'no', 'n'}
+
+
+def _flag_value(field, text):
+    value = text.lower()
+    if value in TRUE_STRINGS:
+        return True
+    if value in FALSE_STRINGS:
+        return False
+    raise ValueError(f"'{field}' must be true or false, not '{text}'")
+
+
+def _term(text):
+    """Compiles one filter term into (predicate, index hint or None)."""
+    negate = text.startswith('!')
+    if negate:
+        text = text[1:]
+
+    if text in FLAGS:
+        field, op, value = text, '=', True
+    else:
+        for op in ('!=', '=', '~'):
+            field, found, value = text.partition(op)
+            if found:
+                break
+        else:
+            raise ValueError(f"Cannot parse filter term '{text}'")
+        if field not in TASK_FIELDS:
+            raise ValueError(f"Unknown field '{field}'")
+        if field in FLAGS:
+            if op == '~':
+                raise ValueError(f"'~' does not apply to '{field}'")
+            value = _flag_value(field, value)
+        elif field == 'id':
+            if op == '~' or not value.isdigit():
+                raise ValueError(f"'id' must be compared to a whole number, not '{value}'")
+            value = int(value)
+        elif not value:
+            # 'category=' matches tasks without a category
+            value = None
+
+    if op == '!=':
+        op, negate = '=', not negate
+
+    if op == '~':
+        needle = (value or '').lower()
+        predicate = lambda task: needle in (getattr(task, field) or '').lower()
+    elif field in FLAGS:
+        predicate = lambda task: bool(getattr(task, field)) == value
+    else:
+        predicate = lambda task: getattr(task, field) == value
+
+    hint = None
+    if negate:
+        inner = predicate
+        predicate = lambda task: not inner(task)
+    elif op == '=' and field in INDEXED and value is not None and value is not False:
+        hint = (field, value)
+    return predicate, hint
+
+
+def _sort_key(sort):
+    """Builds a key over the comma separated fields; '-' on the first one reverses the order."""
+    fields = [field.strip() for field in sort.split(',') if field.strip()]
+    reverse = fields[0].startswith('-')
+    names = []
+    for field in fields:
+        if field.startswith('-') != reverse:
+            raise ValueError("Sort fields must all be ascending or all descending")
+        name = field.lstrip('-')
+        if name not in TASK_FIELDS:
+            raise ValueError(f"Unknown sort field '{name}'")
+        names.append(name)
+    # Titles are unique, so ending on the title gives a total order for cursors
+    if names[-1] != 'title':
+        names.append('title')
+
+    def key(task):
+        # (is None, value) keeps tasks missing a field comparable, and last
+        return tuple((value is None, '' if value is None else value)
+                     for value in (getattr(task, name) for name in names))
+    return key, reverse
+
+
+class Query:
+    """
+    A compiled filter and sort order.
+
+    The filter is whitespace separated terms that must all match:
+    'field=value', 'field!=value', 'field~text' (case-insensitive
+    substring), or a bare 'urgent' / 'completed', any of them negated with
+    a leading '!'. Quote values containing spaces, e.g.
+    'urgent !completed project="Big work"'. The sort is a comma separated
+    list of fields, e.g. 'project,title' or '-urgent,-completed'.
+    """
+
+    def __init__(self, where='', sort=None):
+        self.where = where
+        self.sort = sort
+        self.hints = []
+        predicates = []
+        for text in shlex.split(where or ''):
+            predicate, hint = _term(text)
+            predicates.append(predicate)
+            if hint is not None:
+                self.hints.append(hint)
+
+        if not predicates:
+            self.predicate = lambda task: True
+        elif len(predicates) == 1:
+            self.predicate = predicates[0]
+        else:
+            self.predicate = lambda task: all(predicate(task) for predicate in predicates)
+
+        self.key, self.reverse = _sort_key(sort) if sort else (None, False)
+
+    def cursor(self, task):
+        """The value to pass as `after` to continue right after this task."""
+        return self.key(task)
+
+    def run(self, candidates, limit=None, after=None):
+        """
+        Yields the matching candidates in sort order. With a limit only
+        `limit` rows are kept in a heap instead of sorting everything.
+        """
+        rows = (task for task in candidates if self.predicate(task))
+        if after is not None:
+            if self.key is None:
+                raise ValueError("Paging with 'after' needs a sort order")
+            after = tuple(tuple(part) for part in after)
+            key = self.key
+            if self.reverse:
+                rows = (task for task in rows if key(task) < after)
+            else:
+                rows = (task for task in rows if key(task) > after)
+
+        if self.key is None:
+            yield from islice(rows, limit)
+        elif limit is None:
+            yield from sorted(rows, key=self.key, reverse=self.reverse)
+        else:
+            select = heapq.nlargest if self.reverse else heapq.nsmallest
+            yield from select(limit, rows, key=self.key)
+
+
+@lru_cache(maxsize=256)
+def compile_query(where='', sort=None):
+    """Returns the Query for this filter and sort, compiling it only once."""
+    return Query(where, sort)
@@ -0,0 +1,128 @@
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+TOKEN_RE = re.compile(r"\w+")
+
+# A word in the title counts this many times more than one in the description
+TITLE_WEIGHT = 2
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class SearchIndex:
+    """
+    Inverted index over task titles and descriptions.
+
+    Queries are whitespace separated terms that must all match (AND);
+    'OR' between groups matches either side, and a trailing '*' makes a
+    term a prefix, e.g. "milk kro*" or "report OR timecard".
+    """
+
+    def __init__(self, postings=None, size=0):
+        # token -> {title: weight}
+        self.postings = postings if postings is not None else {}
+        self.size = size
+        self._sorted_tokens = None
+
+    def _terms(self, task):
+        weights = Counter()
+        for token in tokenize(task.title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(task.description):
+            weights[token] += 1
+        return weights
+
+    def add(self, task):
+        for token, weight in self._terms(task).items():
+            titles = self.postings.get(token)
+            if titles is None:
+                titles = self.postings[token] = {}
+                self._sorted_tokens = None
+            titles[task.title] = weight
+        self.size += 1
+
+    def remove(self, task):
+        for token in self._terms(task):
+            titles = self.postings[token]
+            del titles[task.title]
+            if not titles:
+                del self.postings[token]
+                self._sorted_tokens = None
+        self.size -= 1
+
+    def _expand(self, term):
+        """Returns the indexed tokens a query term refers to."""
+        if not term.endswith('*'):
+            return [token for token in tokenize(term) if token in self.postings]
+
+        prefix = term[:-1].lower()
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self.postings)
+        tokens = self._sorted_tokens
+        start = bisect.bisect_left(tokens, prefix)
+        end = start
+        while end < len(tokens) and tokens[end].startswith(prefix):
+            end += 1
+        return tokens[start:end]
+
+    def _score_term(self, term):
+        scores = {}
+        for token in self._expand(term):
+            titles = self.postings[token]
+            idf = math.log(1 + self.size / len(titles))
+            for title, weight in titles.items():
+                scores[title] = scores.get(title, 0) + weight * idf
+        return scores
+
+    def search(self, query, limit=None):
+        """Returns matching titles, best match first."""
+        scores = {}
+        for group in re.split(r'\s+OR\s+', query.strip()):
+            group_scores = None
+            for term in group.split():
+                term_scores = self._score_term(term)
+                if group_scores is None:
+                    group_scores = term_scores
+                else:
+                    group_scores = {
+                        title: score + term_scores[title]
+                        for title, score in group_scores.items() if title in term_scores
+                    }
+                if not group_scores:
+                    break
+
+            for title, score in (group_scores or {}).items():
+                scores[title] = max(scores.get(title, 0), score)
+
+        key = lambda item: (-item[1], item[0])
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, scores.items(), key=key)
+        else:
+            ranked = sorted(scores.items(), key=key)
+        return [title for title, score in ranked]
+
+    def save(self, filename, stamp):
+        """Writes the index, tagged with the stamp of the store it matches."""
+        with open(filename, 'w') as f:
+            json.dump({"stamp": stamp, "size": self.size, "postings": self.postings}, f)
+
+    @classmethod
+    def load(cls, filename, stamp):
+        """Returns the saved index if it was written for this exact store, else None."""
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if data.get("stamp") != stamp:
+            return None
+        return cls(data["postings"], data["size"])
@@ -0,0 +1,1562 @@
+import gzip
+import hashlib
+import json
+import lzma
+import marshal
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import threading
+import zlib
+from array import array
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (e.g. on Windows); a store is then safe for one process only
+    fcntl = None
+
+# Journal size (bytes) after which a background compaction folds it into the checkpoint
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+TASK_FIELDS = ('title', 'description', 'category', 'project', 'urgent', 'completed', 'id')
+
+# magic, version, source mtime_ns, source size, task count, crc32 of everything after the header
+SNAPSHOT_HEADER = struct.Struct('<8sIqqII')
+SNAPSHOT_MAGIC = b'TODOSNAP'
+SNAPSHOT_VERSION = 3
+
+# How much of the file the streaming loader reads at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+DECODER = json.JSONDecoder()
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# The store version is written as the first member of the JSON object
+VERSION_MEMBER = re.compile(r'\{\s*"version":\s*\d+,\s*')
+
+# Compression for a new store is picked by extension; a store is recognised by its magic bytes on load
+CODECS = {'.gz': gzip, '.xz': lzma}
+CODEC_MAGIC = ((b'\x1f\x8b', gzip), (b'\xfd7zXZ\x00', lzma))
+# The defaults (gzip 9, xz 6) save a few percent over these at several times the save latency
+GZIP_LEVEL = 6
+LZMA_PRESET = 1
+# Compressed stores are fed to the compressor this much at a time
+WRITE_CHUNK_SIZE = 1024 * 1024
+DECOMPRESS_ERRORS = (EOFError, gzip.BadGzipFile, lzma.LZMAError, zlib.error)
+# How a whole store ends: the last task, the tasks and the object, or an empty
+# tasks object, or the categories list of a file that lists tasks first
+STORE_END = re.compile(rb'(\}\s*\}|\{\s*\}|\])\s*\}\s*$')
+STORE_TAIL_BYTES = 256
+
+
+def open_storage(filename, **options):
+    """
+    Picks a storage backend from the file name: SQLite for SQLITE_EXTENSIONS,
+    one shard per project for a directory (or a name ending in a separator),
+    a single JSON file otherwise.
+    """
+    if filename.endswith(SQLITE_EXTENSIONS):
+        return SqliteStorage(filename)
+    if os.path.isdir(filename) or filename.endswith(('/', os.sep)):
+        return ShardedStorage(filename, atomic=options.get('atomic', False))
+    return JsonStorage(filename, **options)
+
+
+_NO_TIMER = nullcontext()
+
+
+def timed(metrics, name):
+    """metrics.timer(name), or a shared do-nothing context when metrics are off."""
+    return metrics.timer(name) if metrics is not None else _NO_TIMER
+
+
+def file_stamp(*filenames):
+    """Modification time and size of each existing file, used to detect changes."""
+    stamp = []
+    for name in filenames:
+        if os.path.exists(name):
+            st = os.stat(name)
+            stamp.append([name, st.st_mtime_ns, st.st_size])
+    return stamp
+
+
+def content_digest(content):
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+class WrittenFiles:
+    """
+    Remembers a digest of what was last written to (or read from) each file,
+    so a rewrite with identical content can be skipped. A file whose stamp
+    has changed since, e.g. because another process wrote it, is always rewritten.
+    """
+
+    def __init__(self):
+        # filename -> (digest, stamp)
+        self._files = {}
+
+    def unchanged(self, filename, digest):
+        known = self._files.get(filename)
+        return known is not None and known == (digest, file_stamp(filename))
+
+    def remember(self, filename, digest):
+        self._files[filename] = (digest, file_stamp(filename))
+
+    def digest(self, filename):
+        known = self._files.get(filename)
+        return known[0] if known is not None else None
+
+    def changed(self, filename):
+        """True if the file was written by someone else since we last read or wrote it."""
+        known = self._files.get(filename)
+        if known is None:
+            return os.path.exists(filename)
+        return known[1] != file_stamp(filename)
+
+
+class FileLock:
+    """
+    Advisory lock on '<filename>.lock', so processes sharing a store take
+    turns reading and writing it. A separate file is locked because atomic
+    saves replace the store itself. Does nothing where flock is unavailable.
+    """
+
+    def __init__(self, filename):
+        self.filename = f"{filename}.lock"
+        self._fd = None
+
+    @contextmanager
+    def hold(self, exclusive=True):
+        if fcntl is None:
+            yield
+            return
+        if self._fd is None:
+            try:
+                self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError:
+                # e.g. a read-only directory: nobody can write the store there anyway
+                yield
+                return
+        fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def fsync_directory(filename):
+    """Makes a rename inside the file's directory durable (a no-op where unsupported)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def version_end(content):
+    """
+    Where the version member of a store ends, or 0 for a store without one.
+    Digests skip the version, so a rewrite that would only bump it counts
+    as unchanged.
+    """
+    match = VERSION_MEMBER.match(content)
+    return match.end() if match else 0
+
+
+def codec_for(filename):
+    """gzip or lzma for a store named '.gz' or '.xz', else None."""
+    return CODECS.get(os.path.splitext(filename)[1].lower())
+
+
+def detect_codec(filename):
+    """gzip or lzma if the file starts like one, else None."""
+    with open(filename, 'rb') as f:
+        head = f.read(6)
+    for magic, codec in CODEC_MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def open_text(filename):
+    """Opens a store for reading, decompressing it as it is read if it is gzip or xz, whatever its name."""
+    codec = detect_codec(filename)
+    if codec is not None:
+        return codec.open(filename, 'rt', encoding='utf-8')
+    return open(filename, 'r')
+
+
+def store_complete(filename):
+    """
+    Whether a store was written out in full, without parsing it: a plain
+    one must end its tasks (or, in older files, categories) and the
+    object, a compressed one must decompress to its end.
+    """
+    codec = detect_codec(filename)
+    try:
+        if codec is not None:
+            with codec.open(filename, 'rb') as f:
+                while f.read(WRITE_CHUNK_SIZE):
+                    pass
+            return True
+        with open(filename, 'rb') as f:
+            f.seek(max(0, os.path.getsize(filename) - STORE_TAIL_BYTES))
+            return STORE_END.search(f.read()) is not None
+    except DECOMPRESS_ERRORS:
+        return False
+
+
+def write_encoded(filename, content, codec=None, sync=False):
+    """
+    Writes encoded content, compressing it a chunk at a time with codec
+    (gzip or lzma) if given. Returns the number of bytes written.
+    """
+    with open(filename, 'wb') as f:
+        if codec is None:
+            f.write(content)
+        else:
+            if codec is gzip:
+                # mtime=0 keeps the output the same for the same content
+                out = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+            else:
+                out = lzma.LZMAFile(f, 'wb', preset=LZMA_PRESET)
+            with out:
+                view = memoryview(content)
+                for start in range(0, len(view), WRITE_CHUNK_SIZE):
+                    out.write(view[start:start + WRITE_CHUNK_SIZE])
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+        return f.tell()
+
+
+def merge_names(base, ours, theirs):
+    """Three-way merge of project or category lists: keeps both sides' additions and removals."""
+    base, ours_set, theirs_set = set(base), set(ours), set(theirs)
+    merged = [name for name in theirs if name in ours_set or name not in base]
+    merged += [name for name in ours if name not in theirs_set and name not in base]
+    return merged
+
+
+def merge_output(disk, output, titles, base_meta):
+    """
+    Applies this process's changes on top of a store another process wrote
+    since: the tasks named in `titles` are taken from `output`, every other
+    task from `disk`. Projects and categories are merged against base_meta,
+    the lists as this process last read or wrote them. Both processes hand
+    out ids from the same counter, so any of our tasks whose id the other
+    process used as well is given a new one.
+    """
+    ours = {record['title']: record for record in output['tasks'].values()}
+    tasks = {record['title']: record for record in disk.get('tasks', {}).values()}
+    titles = set(titles)
+    for title in titles:
+        record = ours.get(title)
+        if record is None:
+            tasks.pop(title, None)
+        else:
+            tasks[title] = record
+
+    next_id = max(disk.get('next_id') or 0, output['next_id'])
+    ids = [record.get('id') for record in tasks.values()]
+    used = set(ids)
+    if None not in used and len(used) == len(ids):
+        # Every id is unique, so nothing needs renumbering
+        records = {str(task_id): record for task_id, record in zip(ids, tasks.values())}
+        next_id = max(next_id, max(ids, default=-1) + 1)
+    else:
+        theirs = {record.get('id') for title, record in tasks.items() if title not in titles}
+        used = set()
+        records = {}
+        for title, record in tasks.items():
+            task_id = record.get('id')
+            # A hand-edited store may also have tasks without an id, or with a duplicate one
+            if task_id is None or task_id in used or (title in titles and task_id in theirs):
+                record = dict(record, id=next_id)
+                next_id += 1
+            used.add(record['id'])
+            next_id = max(next_id, record['id'] + 1)
+            records[str(record['id'])] = record
+
+    projects = merge_names(base_meta[0], output['projects'], disk.get('projects', ['General']))
+    categories = merge_names(base_meta[1], output['categories'], disk.get('categories', []))
+    # A task of ours may use a project or category the other process removed
+    for title in titles:
+        record = ours.get(title)
+        if record is not None:
+            if record['project'] not in projects:
+                projects.append(record['project'])
+            if record['category'] and record['category'] not in categories:
+                categories.append(record['category'])
+    return {"projects": projects, "categories": categories, "next_id": next_id, "tasks": records}
+
+
+def build_output(tasks, projects, categories, next_id=0):
+    """
+    Copies the state into plain data, safe to encode on another thread.
+    Tasks are keyed by id; any task without one is numbered from next_id.
+    """
+    records = {}
+    for task in tasks.values():
+        details = task.to_dict()
+        if details['id'] is None:
+            details['id'] = next_id
+        next_id = max(next_id, details['id'] + 1)
+        records[str(details['id'])] = details
+
+    # Everything but the tasks goes first so a streaming load can start without reading them
+    return {
+        "projects": list(projects),
+        "categories": list(categories),
+        "next_id": next_id,
+        "tasks": records
+    }
+
+
+def write_snapshot(filename, source, output, version=0):
+    """
+    Writes a binary copy of `output` (as built by build_output) that is only
+    valid while `source` keeps its current mtime and size.
+    Layout: header, marshalled (projects, categories, next_id, version), an
+    offset table with one entry per task, then one marshalled field tuple per task.
+    """
+    meta = marshal.dumps((output['projects'], output['categories'], output['next_id'], version))
+    offsets = array('I', [0])
+    records = []
+    position = 0
+    for details in output['tasks'].values():
+        record = marshal.dumps(tuple(details[field] for field in TASK_FIELDS))
+        records.append(record)
+        position += len(record)
+        offsets.append(position)
+
+    body = b''.join([struct.pack('<I', len(meta)), meta, offsets.tobytes()] + records)
+    st = os.stat(source)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, st.st_mtime_ns, st.st_size,
+                                  len(records), zlib.crc32(body))
+
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        f.write(header)
+        f.write(body)
+    os.replace(tmp_name, filename)
+
+
+def read_snapshot(filename, source):
+    """
+    Returns (task field tuples, projects, categories, next_id, version) from
+    a snapshot, or None if it is missing, damaged or older than `source`.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        st = os.stat(source)
+    except OSError:
+        return None
+
+    if len(data) < SNAPSHOT_HEADER.size:
+        return None
+    magic, version, mtime_ns, size, count, crc = SNAPSHOT_HEADER.unpack_from(data)
+    if (magic, version, mtime_ns, size) != (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, st.st_mtime_ns, st.st_size):
+        return None
+    body = memoryview(data)[SNAPSHOT_HEADER.size:]
+    if zlib.crc32(body) != crc:
+        return None
+
+    meta_size, = struct.unpack_from('<I', body)
+    projects, categories, next_id, version = marshal.loads(body[4:4 + meta_size])
+    table_start = 4 + meta_size
+    records_start = table_start + (count + 1) * 4
+    offsets = array('I')
+    offsets.frombytes(body[table_start:records_start])
+
+    records = body[records_start:]
+    tasks = [marshal.loads(records[offsets[i]:offsets[i + 1]]) for i in range(count)]
+    return tasks, projects, categories, next_id, version
+
+
+class JsonStream:
+    """Incremental reader for the top-level object of a store file."""
+
+    def __init__(self, f, chunk_size=STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _more(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has been consumed so the buffer stays about one chunk long
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """Skips whitespace and returns the next character ('' at the end of the file)."""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ''
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self.buf, self.pos)
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """Decodes the next value; returns it along with its raw text."""
+        self._peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buf, self.pos)
+                # A value running up to the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    break
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._more()
+
+        raw = self.buf[self.pos:end]
+        self.pos = end
+        return value, raw
+
+    def items(self):
+        """
+        Yields (key, value, raw) for each top-level key, except that every
+        entry of "tasks" is yielded on its own as ('task', value, raw).
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key, _ = self._value()
+            self._expect(':')
+            if key == 'tasks':
+                self._expect('{')
+                if self._peek() == '}':
+                    self.pos += 1
+                else:
+                    while True:
+                        self._value()
+                        self._expect(':')
+                        value, raw = self._value()
+                        yield 'task', value, raw
+                        if self._expect(',}') == '}':
+                            break
+            else:
+                value, raw = self._value()
+                yield key, value, raw
+
+            if self._expect(',}') == '}':
+                return
+
+
+def stream_tasks(filename, factory):
+    """Yields tasks from a JSON store one at a time, without loading the whole file."""
+    with open_text(filename) as f:
+        for key, value, raw in JsonStream(f).items():
+            if key == 'task':
+                yield factory(**value)
+
+
+class LazyTasks(MutableMapping):
+    """
+    title -> Task mapping filled from a JsonStream as it is used.
+    Tasks stay as raw JSON text until they are first accessed; any
+    mutation reads the rest of the file first. If the file turns out to
+    be invalid partway, on_invalid() may return a new file to carry on
+    from, skipping the tasks already read; otherwise `invalid` is set and
+    only the tasks read before that point are kept.
+    """
+
+    def __init__(self, f, factory, on_invalid=None):
+        self._file = f
+        self._items = JsonStream(f).items()
+        self._factory = factory
+        self._on_invalid = on_invalid
+        self.invalid = False
+        # title -> Task, or raw JSON text not yet turned into a Task
+        self._tasks = {}
+        self.meta = {}
+
+    def _pull(self):
+        """Reads up to the next task; returns its title, or None at the end of the file."""
+        while self._items is not None:
+            try:
+                key, value, raw = next(self._items)
+                title = value['title'] if key == 'task' else None
+            except StopIteration:
+                self._items = None
+                self._file.close()
+                return None
+            except (json.JSONDecodeError, TypeError, KeyError) + DECOMPRESS_ERRORS:
+                self._file.close()
+                f = self._on_invalid() if self._on_invalid is not None else None
+                if f is None:
+                    self._items = None
+                    self.invalid = True
+                    return None
+                self._file = f
+                self._items = JsonStream(f).items()
+                continue
+
+            if key == 'task':
+                if title in self._tasks:
+                    # Read before the file was reopened; ours may have changed since
+                    continue
+                self._tasks[title] = raw
+                return title
+            self.meta[key] = value
+        return None
+
+    def drain(self):
+        while self._pull() is not None:
+            pass
+
+    def _find(self, title):
+        while title not in self._tasks:
+            if self._pull() is None:
+                return False
+        return True
+
+    def __getitem__(self, title):
+        if not self._find(title):
+            raise KeyError(title)
+        task = self._tasks[title]
+        if isinstance(task, str):
+            task = self._tasks[title] = self._factory(**json.loads(task))
+        return task
+
+    def __contains__(self, title):
+        return self._find(title)
+
+    def __setitem__(self, title, task):
+        self.drain()
+        self._tasks[title] = task
+
+    def __delitem__(self, title):
+        self.drain()
+        del self._tasks[title]
+
+    def __len__(self):
+        self.drain()
+        return len(self._tasks)
+
+    def __iter__(self):
+        yield from list(self._tasks)
+        while True:
+            title = self._pull()
+            if title is None:
+                return
+            yield title
+
+    def scan(self):
+        """Yields every task without caching the ones that are still raw."""
+        for title in self:
+            task = self._tasks[title]
+            yield self._factory(**json.loads(task)) if isinstance(task, str) else task
+
+
+class JsonStorage:
+    """
+    Stores everything in a single JSON file.
+    With journal=True each write appends a small record to
+    '<filename>.journal' instead of rewriting the whole file.
+    With atomic=True full saves go to a temp file that is fsynced and
+    renamed over the store, so a crash never leaves it half written.
+    With snapshot=True every full save also writes '<filename>.snap', a
+    binary copy that load() uses instead of parsing JSON while it is fresh.
+    With compact=True the JSON is written without indentation. A name
+    ending in '.gz' or '.xz' is written compressed; compressed stores are
+    recognised on load whatever their name, and read as a stream.
+
+    Several processes can share the file: reads and writes hold a lock on
+    '<filename>.lock', and every write bumps the store's "version". A write
+    that finds a newer version on disk is merged task by task with what the
+    other process wrote instead of replacing it; the result is left in
+    `merged` for the owner to take in, as is a store refresh() finds
+    changed. Only full saves are merged, so with a journal the store is
+    still meant for one process.
+    """
+
+    def __init__(self, filename, journal=False, compact_bytes=JOURNAL_COMPACT_BYTES, atomic=False,
+                 snapshot=False, compact=False):
+        self.filename = filename
+        self.codec = codec_for(filename)
+        self._format = {'separators': (',', ':')} if compact else {'indent': 4}
+        self.journal = journal
+        self.journal_name = f"{filename}.journal"
+        self.compact_bytes = compact_bytes
+        self.atomic = atomic
+        self.snapshot = snapshot
+        self.snapshot_name = f"{filename}.snap"
+        # Set by Manager(metrics=...)
+        self.metrics = None
+        # The next unused task id; load() sets None for a store saved before ids existed
+        self.next_id = 0
+        # Version of the store as last read or written, and its projects and categories then
+        self.version = 0
+        self._base_meta = (['General'], [])
+        self._lock = FileLock(filename)
+        # Stamp of the store a lazy load is streaming
+        self._stream_stamp = None
+        # Output of the last write that merged another process's changes; see take_merged()
+        self.merged = None
+        self._merges = 0
+        self._absorbed = 0
+        self._written = WrittenFiles()
+        self._journal_file = None
+        self._journal_bytes = 0
+        self._compactor = None
+
+    def load(self, factory, lazy=False):
+        """
+        Returns (tasks, projects, categories), or None if there is no usable
+        store yet. `factory` builds a task from its saved fields.
+        With lazy=True (and no journal) tasks is a LazyTasks streaming the file.
+        """
+        if not os.path.exists(self.filename):
+            return None
+
+        with self._lock.hold(exclusive=False):
+            state = self._load(factory, lazy)
+        if state is not None:
+            self._base_meta = (list(state[1]), list(state[2]))
+        return state
+
+    def _load(self, factory, lazy):
+        if lazy and not self.journal:
+            return self._load_lazy(factory)
+
+        try:
+            state = self._load_snapshot(factory) if self.snapshot else None
+            if state is None:
+                state = self._load_json(factory)
+                if self.snapshot:
+                    # Refresh the stale or missing snapshot for the next start
+                    write_snapshot(self.snapshot_name, self.filename, build_output(*state, self.next_id),
+                                   self.version)
+
+            if self.journal:
+                with timed(self.metrics, 'load.replay'):
+                    self._replay_journal(state, factory)
+
+        except (json.JSONDecodeError, TypeError, KeyError) + DECOMPRESS_ERRORS:
+            self._discard_invalid()
+            self.next_id = 0
+            return None
+
+        return tuple(state)
+
+    def _load_json(self, factory):
+        with timed(self.metrics, 'load.read'):
+            with open_text(self.filename) as f:
+                content = f.read().strip()
+        if not content:
+            raise json.JSONDecodeError("Empty file", "", 0)
+
+        with timed(self.metrics, 'load.parse'):
+            data = json.loads(content)
+        self._written.remember(self.filename, content_digest(content[version_end(content):]))
+        self.version = data.get('version', 0)
+
+        # Reconstruct Task objects; older files are keyed by title instead of id
+        with timed(self.metrics, 'load.build'):
+            tasks = {
+                details['title']: factory(**details)
+                for details in data.get('tasks', {}).values()
+            }
+        self.next_id = data.get('next_id')
+        return [tasks, data.get('projects', ['General']), data.get('categories', [])]
+
+    def _load_snapshot(self, factory):
+        with timed(self.metrics, 'load.snapshot'):
+            snapshot = read_snapshot(self.snapshot_name, self.filename)
+        if snapshot is None:
+            return None
+        records, projects, categories, self.next_id, self.version = snapshot
+        # Only the stamp is known, so the next write is never skipped
+        self._written.remember(self.filename, None)
+        # Field tuples are in TASK_FIELDS order, which matches Task's arguments
+        with timed(self.metrics, 'load.build'):
+            tasks = {fields[0]: factory(*fields) for fields in records}
+        return [tasks, projects, categories]
+
+    def _load_lazy(self, factory):
+        # A store cut short by a crash is discarded now, as a full load would, not midway through use
+        if not store_complete(self.filename):
+            self._discard_invalid()
+            return None
+
+        self._stream_stamp = file_stamp(self.filename)
+        tasks = LazyTasks(open_text(self.filename), factory)
+        meta = tasks.meta
+        # Older files list tasks first; then this reads on until the metadata turns up
+        while 'projects' not in meta or 'categories' not in meta or 'next_id' not in meta:
+            if tasks._pull() is None:
+                break
+        if tasks.invalid:
+            self._discard_invalid()
+            return None
+        tasks._on_invalid = self._reopen_stream
+
+        self.next_id = meta.get('next_id')
+        self.version = meta.get('version', 0)
+        self._written.remember(self.filename, None)
+        return tasks, meta.get('projects', ['General']), meta.get('categories', [])
+
+    def _reopen_stream(self):
+        """
+        Called when a lazy load finds invalid JSON partway. The stream is not
+        locked, so this is usually another writer saving in place: then the
+        new store is opened, once its write is done, to read the rest from.
+        A store nobody has changed is really damaged; it is copied aside and
+        left where it is, and None keeps the tasks read so far.
+        """
+        with self._lock.hold(exclusive=False):
+            stamp = file_stamp(self.filename)
+            if stamp and stamp != self._stream_stamp:
+                self._stream_stamp = stamp
+                return open_text(self.filename)
+        if stamp:
+            backup_name = f"{self.filename.replace('.json', '')}_backup.json"
+            print(f"Invalid JSON detected partway through {self.filename}; copied it to {backup_name}")
+            shutil.copyfile(self.filename, backup_name)
+        return None
+
+    def _discard_invalid(self):
+        # If invalid, rename to backup and start fresh
+        backup_name = f"{self.filename.replace('.json', '')}_backup.json"
+        print(f"Invalid JSON detected. Renaming {self.filename} to {backup_name}")
+
+        if os.path.exists(self.filename):
+            os.rename(self.filename, backup_name)
+
+    def save(self, tasks, projects, categories, titles=None):
+        """
+        Writes the whole store. With `titles`, the tasks changed since the
+        last write, a newer store on disk is merged with instead of replaced.
+        """
+        # Build the output before truncating the file; a lazy load may still be reading it
+        with timed(self.metrics, 'save.build'):
+            output = build_output(tasks, projects, categories, self.next_id)
+        self._save_output(output, titles, self._absorbed)
+
+    def _save_output(self, output, titles=None, absorbed=None):
+        """
+        Writes a full save. Given the titles changed since the last write,
+        a store another process wrote in the meantime is merged with
+        instead of overwritten; so is our own last merge when `output` was
+        snapshotted before its result was taken in (absorbed < merges).
+        """
+        self._wait_for_compaction()
+        with self._lock.hold():
+            stale = titles is not None and absorbed < self._merges
+            disk = self._read_newer(force=stale)
+            if disk is not None and titles is not None:
+                with timed(self.metrics, 'save.merge'):
+                    output = merge_output(disk, output, titles, self._base_meta)
+                self.merged = output
+                self._merges += 1
+                if self.metrics is not None:
+                    self.metrics.incr('merges')
+            self._write_file(output, self.atomic)
+            self._base_meta = (output['projects'], output['categories'])
+
+        # A full checkpoint makes the journal redundant
+        if self.journal:
+            self._reset_journal()
+
+    def _read_newer(self, force=False):
+        """
+        Returns the parsed store if its content changed since we last read or
+        wrote it (or, with force, whatever is on disk), else None. While
+        nobody else writes this only stats the file. Content is compared
+        rather than versions, since hand edits keep the version as it was.
+        """
+        if not force and not self._written.changed(self.filename):
+            return None
+        try:
+            with open_text(self.filename) as f:
+                content = f.read()
+            data = json.loads(content)
+        except (OSError, ValueError) + DECOMPRESS_ERRORS:
+            return None
+        digest = content_digest(content[version_end(content):])
+        known = self._written.digest(self.filename)
+        self._written.remember(self.filename, digest)
+        if not force and digest == known:
+            return None
+        self.version = max(self.version, data.get('version') or 0)
+        return data
+
+    def refresh(self):
+        """
+        Reads the store if another process or tool has changed it since we
+        last read or wrote it, leaving the result in `merged` as a merging
+        write does. Returns True if there was something new. While nothing
+        changes this costs one stat. A journaled store is not refreshed.
+        """
+        if self.journal or not self._written.changed(self.filename):
+            return False
+        with self._lock.hold(exclusive=False):
+            disk = self._read_newer()
+        if disk is None:
+            return False
+        ours = {"projects": self._base_meta[0], "categories": self._base_meta[1], "next_id": 0, "tasks": {}}
+        # Merging in no changes of our own still numbers tasks added by hand
+        self.merged = merge_output(disk, ours, (), self._base_meta)
+        self._merges += 1
+        self._base_meta = (self.merged['projects'], self.merged['categories'])
+        return True
+
+    def take_merged(self):
+        """
+        Returns the output of the last write (or refresh()) that merged in
+        another process's changes, or None. The caller must take those changes into
+        its state before preparing its next write, and call this under the
+        same lock as prepare().
+        """
+        merged, self.merged = self.merged, None
+        self._absorbed = self._merges
+        return merged
+
+    def _write_file(self, output, atomic):
+        with timed(self.metrics, 'save.encode'):
+            version = self.version + 1
+            text = json.dumps({"version": version, **output}, **self._format)
+            content = text.encode()
+            # Leave the version out of the digest, as on load
+            digest = content_digest(memoryview(content)[version_end(text):])
+        if self._written.unchanged(self.filename, digest):
+            if self.metrics is not None:
+                self.metrics.incr('skipped_writes')
+            return
+        self.version = version
+
+        with timed(self.metrics, 'save.write'):
+            if not atomic:
+                written = write_encoded(self.filename, content, self.codec)
+            else:
+                tmp_name = self.filename + '.tmp'
+                written = write_encoded(tmp_name, content, self.codec, sync=True)
+                os.replace(tmp_name, self.filename)
+                fsync_directory(self.filename)
+        self._written.remember(self.filename, digest)
+        if self.metrics is not None:
+            self.metrics.incr('bytes_written', written)
+
+        if self.snapshot:
+            with timed(self.metrics, 'save.snapshot'):
+                write_snapshot(self.snapshot_name, self.filename, output, self.version)
+
+    def prepare(self, tasks, projects, categories, titles, meta=False):
+        """
+        Snapshots a change to the given tasks and returns a function that
+        writes it. Only the snapshot needs the caller's data to hold still;
+        the returned function can run on another thread.
+        Without a journal this is a full save; with one, each task becomes a
+        'put' (or 'del' if it no longer exists) record.
+        """
+        if not self.journal:
+            with timed(self.metrics, 'save.build'):
+                output = build_output(tasks, projects, categories, self.next_id)
+            return partial(self._save_output, output, list(titles), self._absorbed)
+
+        records = []
+        for title in titles:
+            task = tasks.get(title)
+            if task is None:
+                records.append({"op": "del", "title": title})
+            else:
+                records.append({"op": "put", "task": task.to_dict()})
+        if meta:
+            records.append({"op": "meta", "projects": list(projects), "categories": list(categories),
+                            "next_id": self.next_id})
+        lines = ''.join(json.dumps(r) + '\n' for r in records)
+
+        checkpoint = None
+        if self._journal_bytes + len(lines) >= self.compact_bytes:
+            checkpoint = build_output(tasks, projects, categories, self.next_id)
+        return partial(self._append_journal, lines, checkpoint)
+
+    def write(self, tasks, projects, categories, titles, meta=False):
+        """Persists a change to the given tasks right away."""
+        self.prepare(tasks, projects, categories, titles, meta)()
+
+    def stamp(self):
+        return file_stamp(self.filename, self.journal_name, self.journal_name + '.old')
+
+    def close(self):
+        """Waits for a running compaction and closes the journal and lock files."""
+        self._wait_for_compaction()
+        if self._journal_file:
+            self._journal_file.close()
+            self._journal_file = None
+        self._lock.close()
+
+    # ------------------------------------------------------------------
+    # Journal
+    # ------------------------------------------------------------------
+    def _append_journal(self, lines, checkpoint=None):
+        with timed(self.metrics, 'journal.append'):
+            if self._journal_file is None:
+                self._journal_file = open(self.journal_name, 'a')
+            self._journal_file.write(lines)
+            self._journal_file.flush()
+        self._journal_bytes = self._journal_file.tell()
+        if self.metrics is not None:
+            self.metrics.incr('bytes_written', len(lines))
+
+        if checkpoint is not None:
+            self._start_compaction(checkpoint)
+
+    def _replay_journal(self, state, factory):
+        """
+        Applies the journal on top of the loaded checkpoint.
+        A leftover '.old' journal means a compaction was interrupted; it is
+        replayed first and then folded into a fresh checkpoint.
+        """
+        old_name = self.journal_name + '.old'
+        interrupted = os.path.exists(old_name)
+        tasks = state[0]
+
+        for name in (old_name, self.journal_name):
+            if not os.path.exists(name):
+                continue
+            with open(name, 'rb') as f:
+                # End of the last whole line; a record is written with its newline in one go
+                end = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Torn final write from a crash
+                        break
+                    end += len(line)
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Left by a torn write that older versions appended after; later records still apply
+                        continue
+
+                    op = record["op"]
+                    if op == "put":
+                        task = factory(**record["task"])
+                        tasks[task.title] = task
+                    elif op == "del":
+                        tasks.pop(record["title"], None)
+                    elif op == "meta":
+                        state[1] = record["projects"]
+                        state[2] = record["categories"]
+                        self.next_id = record.get("next_id", self.next_id)
+
+            if end < os.path.getsize(name):
+                # Cut the torn record off, or the next append would run into it and be lost too
+                with open(name, 'r+b') as f:
+                    f.truncate(end)
+
+        if interrupted:
+            self.save(*state)
+        elif os.path.exists(self.journal_name):
+            self._journal_bytes = os.path.getsize(self.journal_name)
+
+    def _reset_journal(self):
+        if self._journal_file:
+            self._journal_file.close()
+            self._journal_file = None
+        self._journal_bytes = 0
+        for name in (self.journal_name, self.journal_name + '.old'):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def compact(self, tasks, projects, categories):
+        """
+        Folds the journal into the checkpoint on a background thread.
+        The journal is rotated to '.old' first so new writes keep
+        appending while the checkpoint is written.
+        """
+        # Copy the state now; encoding and disk I/O happen off-thread
+        self._start_compaction(build_output(tasks, projects, categories, self.next_id))
+
+    def _start_compaction(self, output):
+        if self._compactor and self._compactor.is_alive():
+            return
+        if not os.path.exists(self.journal_name):
+            return
+
+        if self._journal_file:
+            self._journal_file.close()
+            self._journal_file = None
+        old_name = self.journal_name + '.old'
+        os.replace(self.journal_name, old_name)
+        self._journal_bytes = 0
+
+        self._compactor = threading.Thread(target=self._write_checkpoint, args=(output, old_name))
+        self._compactor.start()
+
+    def _write_checkpoint(self, output, old_name):
+        self._write_file(output, atomic=True)
+        os.remove(old_name)
+
+    def _wait_for_compaction(self):
+        if self._compactor:
+            self._compactor.join()
+            self._compactor = None
+
+
+class SqliteTasks(MutableMapping):
+    """
+    title -> Task mapping over a SqliteStorage database.
+    A task's row is read the first time it is looked up, through the index
+    on title; counting or iterating the tasks reads all of them once.
+    """
+
+    def __init__(self, storage, factory):
+        self._storage = storage
+        self._factory = factory
+        self._tasks = {}
+        self._complete = False
+        # Titles set or deleted since load; their rows must not override them
+        self._overridden = set()
+
+    def drain(self):
+        if self._complete:
+            return
+        for details in self._storage._records():
+            title = details['title']
+            if title not in self._tasks and title not in self._overridden:
+                self._tasks[title] = self._factory(**details)
+        self._complete = True
+        self._overridden = set()
+
+    def _find(self, title):
+        if title in self._tasks:
+            return True
+        if self._complete or title in self._overridden:
+            return False
+        details = self._storage._record(title)
+        if details is None:
+            return False
+        self._tasks[title] = self._factory(**details)
+        return True
+
+    def __getitem__(self, title):
+        if not self._find(title):
+            raise KeyError(title)
+        return self._tasks[title]
+
+    def __contains__(self, title):
+        return self._find(title)
+
+    def __setitem__(self, title, task):
+        if not self._complete:
+            self._overridden.add(title)
+        self._tasks[title] = task
+
+    def __delitem__(self, title):
+        if not self._find(title):
+            raise KeyError(title)
+        if not self._complete:
+            self._overridden.add(title)
+        del self._tasks[title]
+
+    def __len__(self):
+        self.drain()
+        return len(self._tasks)
+
+    def __iter__(self):
+        self.drain()
+        return iter(self._tasks)
+
+
+class SqliteStorage:
+    """
+    Stores one row per task in an SQLite database (WAL mode), keyed by task id.
+    Writes only touch the rows of the tasks that changed. load() reads only
+    the metadata; tasks come from a SqliteTasks as they are needed.
+    """
+
+    UPSERT = (
+        f"INSERT OR REPLACE INTO tasks ({', '.join(TASK_FIELDS)}) "
+        f"VALUES ({', '.join('?' * len(TASK_FIELDS))})"
+    )
+    # A deleted task is gone from memory by the time it is written, so only its title is known
+    DELETE = "DELETE FROM tasks WHERE title = ?"
+
+    def __init__(self, filename):
+        self.filename = filename
+        # Set by Manager(metrics=...)
+        self.metrics = None
+        self.next_id = 0
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        # Changes whenever another connection commits; see refresh()
+        self._data_version = self._read_data_version()
+        self.merged = None
+
+    TABLE = (
+        "CREATE TABLE {} ("
+        "id INTEGER PRIMARY KEY, title TEXT NOT NULL UNIQUE, description TEXT, category TEXT, "
+        "project TEXT, urgent INTEGER NOT NULL DEFAULT 0, "
+        "completed INTEGER NOT NULL DEFAULT 0)"
+    )
+
+    def _create_schema(self):
+        with self.conn:
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")]
+            if not columns:
+                self.conn.execute(self.TABLE.format('tasks'))
+            elif 'id' not in columns:
+                # Databases from before task ids were keyed by title; number the rows in place
+                self.conn.execute(self.TABLE.format('tasks_new'))
+                self.conn.execute(
+                    "INSERT INTO tasks_new (id, title, description, category, project, urgent, completed) "
+                    "SELECT rowid - 1, title, description, category, project, urgent, completed FROM tasks"
+                )
+                self.conn.execute("DROP TABLE tasks")
+                self.conn.execute("ALTER TABLE tasks_new RENAME TO tasks")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            for column in ('project', 'category', 'urgent', 'completed'):
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS tasks_{column} ON tasks ({column})")
+
+    def _row(self, task):
+        return (task.title, task.description, task.category, task.project,
+                int(task.urgent), int(task.completed), task.id)
+
+    def load(self, factory, lazy=False):
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if not meta:
+            return None
+
+        tasks = SqliteTasks(self, factory)
+        self._data_version = self._read_data_version()
+        if 'next_id' in meta:
+            self.next_id = json.loads(meta['next_id'])
+        else:
+            self.next_id = self._max_id() + 1
+        return tasks, json.loads(meta['projects']), json.loads(meta['categories'])
+
+    def _records(self):
+        with timed(self.metrics, 'load.build'):
+            rows = self.conn.execute(f"SELECT {', '.join(TASK_FIELDS)} FROM tasks").fetchall()
+        for row in rows:
+            yield self._details(row)
+
+    def _record(self, title):
+        row = self.conn.execute(f"SELECT {', '.join(TASK_FIELDS)} FROM tasks WHERE title = ?", (title,)).fetchone()
+        return self._details(row) if row is not None else None
+
+    @staticmethod
+    def _details(row):
+        details = dict(zip(TASK_FIELDS, row))
+        details['urgent'] = bool(details['urgent'])
+        details['completed'] = bool(details['completed'])
+        return details
+
+    def _read_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _max_id(self):
+        return self.conn.execute("SELECT COALESCE(MAX(id), -1) FROM tasks").fetchone()[0]
+
+    def _write_meta(self, projects, categories, next_id):
+        if next_id is None:
+            # Rows saved without an id were numbered by SQLite
+            next_id = self._max_id() + 1
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [('projects', json.dumps(list(projects))), ('categories', json.dumps(list(categories))),
+             ('next_id', json.dumps(next_id))]
+        )
+
+    def save(self, tasks, projects, categories, titles=None):
+        with timed(self.metrics, 'save.write'), self.conn:
+            self.conn.execute("DELETE FROM tasks")
+            self.conn.executemany(self.UPSERT, (self._row(task) for task in tasks.values()))
+            self._write_meta(projects, categories, self.next_id)
+        if self.metrics is not None:
+            self.metrics.incr('rows_written', len(tasks))
+
+    def prepare(self, tasks, projects, categories, titles, meta=False):
+        """Snapshots the rows for the given titles; the returned function upserts or deletes them."""
+        upserts = []
+        deletes = []
+        for title in titles:
+            task = tasks.get(title)
+            if task is None:
+                deletes.append((title,))
+            else:
+                upserts.append(self._row(task))
+        if meta:
+            meta = (list(projects), list(categories), self.next_id)
+        return partial(self._apply, upserts, deletes, meta)
+
+    def _apply(self, upserts, deletes, meta):
+        with timed(self.metrics, 'save.write'), self.conn:
+            if deletes:
+                self.conn.executemany(self.DELETE, deletes)
+            if upserts:
+                self.conn.executemany(self.UPSERT, upserts)
+            if meta:
+                self._write_meta(*meta)
+        if self.metrics is not None:
+            self.metrics.incr('rows_written', len(upserts) + len(deletes))
+
+    def write(self, tasks, projects, categories, titles, meta=False):
+        self.prepare(tasks, projects, categories, titles, meta)()
+
+    def stamp(self):
+        return file_stamp(self.filename, self.filename + '-wal')
+
+    def refresh(self):
+        """
+        Reads every row again if another connection has committed since we
+        last looked, leaving them in `merged`. Returns True if there was
+        something new; otherwise this is one PRAGMA query.
+        """
+        version = self._read_data_version()
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        records = {str(details['id']): details for details in self._records()}
+        self.merged = {
+            "projects": json.loads(meta.get('projects', '["General"]')),
+            "categories": json.loads(meta.get('categories', '[]')),
+            "next_id": json.loads(meta['next_id']) if 'next_id' in meta else self._max_id() + 1,
+            "tasks": records,
+        }
+        return True
+
+    def take_merged(self):
+        # Writers are already serialized by SQLite and only touch their own rows; only refresh() sets this
+        merged, self.merged = self.merged, None
+        return merged
+
+    def close(self):
+        self.conn.close()
+
+
+class ShardedTasks(MutableMapping):
+    """
+    title -> Task mapping over a ShardedStorage directory.
+    A project's shard is read the first time one of its tasks is needed;
+    the manifest's title index says which shard that is, so looking up a
+    title reads at most one shard, and a title that is not stored none.
+    """
+
+    def __init__(self, storage, factory, projects):
+        self._storage = storage
+        self._factory = factory
+        self._tasks = {}
+        self._unloaded = dict.fromkeys(projects)
+        # Titles set or deleted before their shard was read; the shard must not override them
+        self._overridden = set()
+
+    def load_project(self, project):
+        if project not in self._unloaded:
+            return
+        del self._unloaded[project]
+        # Shards are keyed by id (by title in older stores); either way the title is in the record
+        for details in self._storage._read_shard(project).values():
+            title = details['title']
+            if title not in self._overridden:
+                self._storage._track(title, project)
+                self._tasks[title] = self._factory(**details)
+
+    def drain(self):
+        while self._unloaded:
+            self.load_project(next(iter(self._unloaded)))
+
+    def _find(self, title):
+        if title not in self._tasks:
+            project = self._storage._written_in.get(title)
+            if project is not None:
+                self.load_project(project)
+        return title in self._tasks
+
+    def __getitem__(self, title):
+        if not self._find(title):
+            raise KeyError(title)
+        return self._tasks[title]
+
+    def __contains__(self, title):
+        return self._find(title)
+
+    def __setitem__(self, title, task):
+        if self._unloaded:
+            self._overridden.add(title)
+        self._tasks[title] = task
+
+    def __delitem__(self, title):
+        if not self._find(title):
+            raise KeyError(title)
+        if self._unloaded:
+            self._overridden.add(title)
+        del self._tasks[title]
+
+    def __len__(self):
+        self.drain()
+        return len(self._tasks)
+
+    def __iter__(self):
+        self.drain()
+        return iter(self._tasks)
+
+    def loaded(self):
+        """The tasks read so far, without touching the remaining shards."""
+        return self._tasks
+
+
+class ShardedStorage:
+    """
+    Stores each project in its own JSON file inside a directory, plus a
+    'manifest.json' holding projects, categories, the shard names and which
+    project each title is stored under. Writes only rewrite the shards of
+    projects whose tasks changed, and the manifest when a title is added,
+    removed or moved to another project.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, dirname, atomic=False):
+        self.dirname = dirname
+        self.atomic = atomic
+        self.manifest_name = os.path.join(dirname, self.MANIFEST)
+        # Set by Manager(metrics=...)
+        self.metrics = None
+        # The next unused task id; load() sets None for a store saved before ids existed
+        self.next_id = 0
+        self._written = WrittenFiles()
+        # project -> shard file name
+        self._shards = {}
+        self._next_shard = 0
+        # Where each title was last written, and the reverse; the manifest keeps the latter
+        self._written_in = {}
+        self._members = {}
+        self._index_changed = False
+        self._tasks = None
+
+    def _track(self, title, project):
+        old = self._written_in.get(title)
+        if old == project:
+            return
+        self._index_changed = True
+        if old is not None:
+            self._members[old].pop(title, None)
+        if project is None:
+            self._written_in.pop(title, None)
+        else:
+            self._written_in[title] = project
+            self._members.setdefault(project, {})[title] = None
+
+    def _read_shard(self, project):
+        with timed(self.metrics, 'load.parse'):
+            with open(os.path.join(self.dirname, self._shards[project]), 'r') as f:
+                return json.load(f)['tasks']
+
+    def _write_json(self, filename, data):
+        with timed(self.metrics, 'save.encode'):
+            content = json.dumps(data, indent=4)
+            digest = content_digest(content)
+        if self._written.unchanged(filename, digest):
+            if self.metrics is not None:
+                self.metrics.incr('skipped_writes')
+            return
+
+        with timed(self.metrics, 'save.write'):
+            tmp_name = filename + '.tmp'
+            with open(tmp_name, 'w') as f:
+                f.write(content)
+                if self.atomic:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_name, filename)
+        self._written.remember(filename, digest)
+        if self.metrics is not None:
+            self.metrics.incr('bytes_written', len(content))
+
+    def load(self, factory, lazy=False):
+        if not os.path.exists(self.manifest_name):
+            return None
+        with open(self.manifest_name, 'r') as f:
+            manifest = json.load(f)
+        self._shards = manifest.get('shards', {})
+        self._next_shard = manifest.get('next_shard', len(self._shards))
+        self.next_id = manifest.get('next_id')
+        members = manifest.get('titles')
+        if members is None:
+            # Older stores have no title index; build it from the shards once, the next write keeps it
+            members = {project: [details['title'] for details in self._read_shard(project).values()]
+                       for project in self._shards}
+        for project, titles in members.items():
+            for title in titles:
+                self._track(title, project)
+        self._index_changed = 'titles' not in manifest
+        self._tasks = ShardedTasks(self, factory, self._shards)
+        return self._tasks, manifest.get('projects', ['General']), manifest.get('categories', [])
+
+    def _load_project(self, tasks, project):
+        if isinstance(tasks, ShardedTasks):
+            tasks.load_project(project)
+
+    def _snapshot_shards(self, tasks, projects):
+        """Returns {project: records or None to remove} for the given projects."""
+        tasks = tasks.loaded() if isinstance(tasks, ShardedTasks) else tasks
+        shards = {}
+        for project in projects:
+            titles = self._members.get(project)
+            if titles:
+                shards[project] = {str(task.id): task.to_dict() for task in map(tasks.__getitem__, titles)}
+            elif project in self._shards:
+                shards[project] = None
+        return shards
+
+    def prepare(self, tasks, projects, categories, titles, meta=False):
+        """Snapshots the shards touched by the given titles; the returned function rewrites them."""
+        # Every changed task was looked up first, so its shard is already in memory
+        loaded = tasks.loaded() if isinstance(tasks, ShardedTasks) else tasks
+        dirty = {}
+        for title in titles:
+            old = self._written_in.get(title)
+            task = loaded.get(title)
+            new = task.project if task is not None else None
+            if new is not None:
+                # Shard contents are written whole, so the target must be read first
+                self._load_project(tasks, new)
+            self._track(title, new)
+            dirty[old] = dirty[new] = None
+        dirty.pop(None, None)
+
+        shards = self._snapshot_shards(tasks, dirty)
+        manifest = self._update_manifest(shards, projects, categories, meta)
+        return partial(self._apply, shards, dict(self._shards), manifest)
+
+    def save(self, tasks, projects, categories, titles=None):
+        """Rewrites every shard that has been read, plus the manifest."""
+        loaded = tasks.loaded() if isinstance(tasks, ShardedTasks) else tasks
+        # A task moved into a project that was never read would otherwise replace its shard
+        for project in {task.project for task in list(loaded.values())}:
+            self._load_project(tasks, project)
+        unloaded = tasks._unloaded if isinstance(tasks, ShardedTasks) else {}
+        for title, task in loaded.items():
+            self._track(title, task.project)
+        for title in [t for t, project in self._written_in.items() if t not in loaded and project not in unloaded]:
+            self._track(title, None)
+
+        touched = {project: None for project in self._members if project not in unloaded}
+        shards = self._snapshot_shards(tasks, touched)
+        manifest = self._update_manifest(shards, projects, categories, True)
+        self._apply(shards, dict(self._shards), manifest)
+
+    def _update_manifest(self, shards, projects, categories, meta):
+        """Assigns files to new shards; returns the manifest if it needs rewriting, else None."""
+        changed = meta or self._index_changed
+        for project, records in shards.items():
+            if records is None:
+                self._shards.pop(project, None)
+                changed = True
+            elif project not in self._shards:
+                self._shards[project] = f"shard-{self._next_shard:04d}.json"
+                self._next_shard += 1
+                changed = True
+        if not changed:
+            return None
+        self._index_changed = False
+        return {
+            "projects": list(projects),
+            "categories": list(categories),
+            "shards": dict(self._shards),
+            "next_shard": self._next_shard,
+            "next_id": self.next_id,
+            "titles": {project: list(titles) for project, titles in self._members.items() if titles}
+        }
+
+    def _apply(self, shards, names, manifest):
+        os.makedirs(self.dirname, exist_ok=True)
+        for project, records in shards.items():
+            if records is not None:
+                self._write_json(os.path.join(self.dirname, names[project]), {"tasks": records})
+        if manifest is None:
+            return
+        self._write_json(self.manifest_name, manifest)
+
+        # Drop emptied shards only once the manifest no longer points at them
+        for name in set(os.listdir(self.dirname)) - set(names.values()) - {self.MANIFEST}:
+            if name.startswith('shard-'):
+                os.remove(os.path.join(self.dirname, name))
+
+    def write(self, tasks, projects, categories, titles, meta=False):
+        self.prepare(tasks, projects, categories, titles, meta)()
+
+    def refresh(self):
+        # Shards are not merged across processes
+        return False
+
+    def take_merged(self):
+        return None
+
+    def stamp(self):
+        names = [self.manifest_name] + [os.path.join(self.dirname, name) for name in self._shards.values()]
+        return file_stamp(*names)
+
+    def close(self):
+        pass
+
+
+def migrate_json_to_sqlite(json_filename, db_filename):
+    """Copies an existing JSON store (and its journal, if any) into an SQLite database."""
+    from todo import Task
+
+    source = JsonStorage(json_filename, journal=True)
+    data = source.load(Task)
+    if data is None:
+        print(f"Nothing to migrate from {json_filename}.")
+        return
+
+    storage = SqliteStorage(db_filename)
+    # None for a store from before task ids; SQLite then numbers the rows
+    storage.next_id = source.next_id
+    storage.save(*data)
+    storage.close()
+    print(f"Migrated {len(data[0])} tasks from {json_filename} to {db_filename}.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate a todo JSON store to SQLite")
+    parser.add_argument('source', help='JSON store to read (e.g. todo.json)')
+    parser.add_argument('target', help='SQLite database to create (e.g. todo.db)')
+    args = parser.parse_args()
+
+    migrate_json_to_sqlite(args.source, args.target)